@@ -0,0 +1,205 @@
+"""
+A matcher which tests a word against many patterns at once.
+
+The patterns found by patternize and classify only ever use a tiny part of the regex dialect:
+single characters, character classes, optional gaps (.*) and anchors.
+All the patterns are therefore compiled into one bit-parallel NFA (in the style of Shift-And),
+where every element of every pattern is one bit of a Python integer.
+A single pass over a word then tells which of the patterns match it,
+instead of running a separate regex for every pattern.
+
+The matcher follows the semantics of re.match on each pattern's regex.
+Patterns which can't be compiled into the automaton (e.g. with regex metacharacters in them)
+are matched with re instead.
+"""
+
+import re
+from collections import defaultdict
+
+from regexi import patternize
+
+# characters which mean something else in a regex than themselves
+SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+CLASS_SPECIAL_CHARACTERS = frozenset('^-]\\[')
+
+
+def get_element_characters(element):
+    """
+    Get the set of characters an element of a pattern stands for,
+    or None if the element can't be handled by the automaton.
+    """
+    if isinstance(element, str) and len(element) == 1:
+        if element in SPECIAL_CHARACTERS:
+            return None
+        return frozenset(element)
+
+    characters = list(element)
+    if not all(isinstance(character, str) and len(character) == 1 for character in characters):
+        return None
+
+    if len(characters) == 1:
+        if characters[0] in SPECIAL_CHARACTERS:
+            return None
+    elif CLASS_SPECIAL_CHARACTERS.intersection(characters):
+        return None
+
+    return frozenset(characters)
+
+
+def parse_pattern(pattern):
+    """
+    Turn a pattern (as made by patternize) into a list of elements for the automaton.
+    :param pattern: a classify.Pattern, or a sequence of elements
+    :return: whether the first element has to match the first character,
+        a list of [characters, may be followed by anything] pairs,
+        and whether the last element has to match the last character
+        (or None if the pattern can't be handled by the automaton)
+    """
+    elements = list(getattr(pattern, 'pattern', pattern))
+
+    if elements and elements[0] == '^':
+        elements = elements[1:]
+
+    end_anchored = False
+    if elements and elements[-1] == '$':
+        end_anchored = True
+        elements = elements[:-1]
+
+    leading_gap = False
+    items = []
+
+    for element in elements:
+        if not element:
+            # None (or anything else that patternize.make_regex turns into .*)
+            if items:
+                items[-1][1] = True
+            else:
+                leading_gap = True
+            continue
+
+        characters = get_element_characters(element)
+        if characters is None:
+            return None
+
+        items.append([characters, False])
+
+    if not end_anchored and items:
+        # re.match only needs the pattern to match the beginning of the word
+        items[-1][1] = True
+
+    return not leading_gap, items, end_anchored
+
+
+class PatternMatcher:
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+        self._masks = defaultdict(int)
+        self._firsts = 0
+        self._initial_anywhere = 0
+        self._initial_at_start = 0
+        self._gaps = 0
+        self._accept = 0
+        self._owners = {}
+
+        # patterns which match every word, or only empty words
+        self._match_all = []
+        self._match_empty = []
+        # patterns which are matched with re
+        self._fallback = []
+
+        # regexes can't be made without lego (and the patterns' regexes aren't really regexes then)
+        use_automaton = patternize.lego is not None
+
+        bit = 0
+        for n, pattern in enumerate(self.patterns):
+            parsed = parse_pattern(pattern) if use_automaton else None
+
+            if parsed is None:
+                self._fallback.append(n)
+                continue
+
+            start_anchored, items, end_anchored = parsed
+
+            if not items:
+                if end_anchored and start_anchored:
+                    self._match_empty.append(n)
+                else:
+                    self._match_all.append(n)
+                continue
+
+            first = 1 << bit
+            self._firsts |= first
+            if start_anchored:
+                self._initial_at_start |= first
+            else:
+                self._initial_anywhere |= first
+
+            for characters, gap in items:
+                for character in characters:
+                    self._masks[character] |= 1 << bit
+                if gap:
+                    self._gaps |= 1 << bit
+                bit += 1
+
+            last = 1 << (bit - 1)
+            self._accept |= last
+            self._owners[bit - 1] = n
+
+        self.size = bit
+
+    def _run(self, word):
+        masks = self._masks
+        not_firsts = ~self._firsts
+        anywhere = self._initial_anywhere
+        gaps = self._gaps
+
+        state = 0
+        initial = anywhere | self._initial_at_start
+        for character in word:
+            state = ((((state << 1) & not_firsts) | initial) & masks.get(character, 0)
+                     | state & gaps)
+            initial = anywhere
+
+        return state & self._accept
+
+    def match_indexes(self, word):
+        """
+        Get the indexes of the patterns which match the word
+        """
+        accepted = self._run(word)
+        owners = self._owners
+
+        while accepted:
+            lowest = accepted & -accepted
+            yield owners[lowest.bit_length() - 1]
+            accepted ^= lowest
+
+        yield from self._match_all
+        if not word:
+            yield from self._match_empty
+
+        for n in self._fallback:
+            if re.match(str(self.patterns[n]), word):
+                yield n
+
+    def matches(self, word):
+        """
+        Get the patterns which match the word
+        """
+        return [self.patterns[n] for n in self.match_indexes(word)]
+
+    def match_sets(self, words):
+        """
+        :return: a dict of every pattern (in the original order) and the set of words it matches
+        """
+        sets = [set() for _ in self.patterns]
+        for word in words:
+            for n in self.match_indexes(word):
+                sets[n].add(word)
+
+        return dict(zip(self.patterns, sets))
+
+    @property
+    def num_fallback(self):
+        return len(self._fallback)
@@ -1,26 +1,92 @@
 __author__ = 'Anton Osten'
 
-import functools
+import gzip
+import heapq
 import itertools
+import json
+import os
 import pprint
+import random
 import re
 import statistics
+import sys
+import threading
+import time
+import weakref
 from argparse import ArgumentParser
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
+from collections.abc import Mapping
 from pathlib import Path
 
 import Levenshtein as lev
 import math
 
-from regexi import patternize
+try:
+    from rapidfuzz import process as rf_process
+    from rapidfuzz.distance import Indel
+except ImportError:
+    # python-Levenshtein is built on rapidfuzz, but older versions of it weren't
+    rf_process = None
+
+from regexi import corpus, minhash, patternize
+from regexi.automaton import PatternMatcher
+from regexi.matchstore import MatchStore, MemoryPool
+from regexi.resultcache import ResultCache
+from regexi.substrings import SuffixAutomaton, get_shared_prefixes
+from regexi.instrument import Instrumentation, NO_INSTRUMENTATION
+
+# words whose Levenshtein ratio is below this are not put in the same group
+MIN_RATIO = 0.39
+
+CHECKPOINT_VERSION = 1
+
+# how many Levenshtein ratios of pairs of words are cached during a run by default
+RATIO_CACHE_SIZE = 250000
+
+# how many patterns are scored after the budget has run out
+BUDGET_SCORED_PATTERNS = 100
 
 
 class Pattern:
-    def __init__(self, pattern):
+    """
+    Patterns are interned: making a pattern which is equivalent to one that already exists
+    gives back the existing object, so that comparing patterns (which are used as keys in dicts all the time)
+    is mostly a matter of comparing their identities, and their hashes are only computed once.
+    """
 
-        self.pattern = self._clean_up(pattern)
-        self.skeleton = tuple(element for element in self.pattern if element)
-        self._regex = None
+    _interned = weakref.WeakValueDictionary()
+    _interning_lock = threading.Lock()
+
+    def __new__(cls, pattern, clean_up=True):
+        """
+        :param pattern: a list of elements, as made by patternize
+        :param clean_up: whether to add (or remove) the anchors
+            (patterns loaded from a file have already been cleaned up)
+        """
+        if clean_up:
+            pattern = cls._clean_up(pattern)
+        pattern = cls._canonicalize(pattern)
+
+        # equivalent patterns have the same canonical form, and so the same key
+        key = tuple(element.value if isinstance(element, patternize.AmbiguousElement)
+                    else element for element in pattern)
+
+        with cls._interning_lock:
+            self = cls._interned.get(key)
+            if self is None:
+                self = super().__new__(cls)
+                self.pattern = pattern
+                self.skeleton = tuple(element for element in pattern if element)
+                self._regex = None
+                self._key = key
+                self._hash = hash(key)
+                cls._interned[key] = self
+
+        return self
+
+    def __reduce__(self):
+        # unpickled patterns are interned too
+        return Pattern, (self.pattern, False)
 
     @staticmethod
     def _clean_up(pattern):
@@ -42,7 +108,37 @@ class Pattern:
 
         return tuple(pattern)
 
+    @staticmethod
+    def _canonicalize(pattern):
+        """
+        Bring patterns which make the same regex to the same form:
+        runs of Nones become a single None, and ambiguous elements with one character become that character.
+        The anchors are kept even where they are next to a None (and so mean nothing in the regex),
+        since they count towards the length the patterns are scored by.
+        """
+        elements = []
+        for element in pattern:
+            if isinstance(element, patternize.AmbiguousElement) and len(element) == 1:
+                element = next(iter(element))
+
+            if element is None and elements and elements[-1] is None:
+                continue
+            elements.append(element)
+
+        return tuple(elements)
 
+    def to_json(self):
+        """
+        :return: the elements of the pattern, with ambiguous elements as lists of characters
+        """
+        return [sorted(element) if isinstance(element, patternize.AmbiguousElement) else element
+                for element in self.pattern]
+
+    @classmethod
+    def from_json(cls, elements):
+        elements = [patternize.AmbiguousElement(*element) if isinstance(element, list) else element
+                    for element in elements]
+        return cls(elements, clean_up=False)
 
     @property
     def regex(self):
@@ -63,10 +159,14 @@ class Pattern:
         return len(self.skeleton)
 
     def __hash__(self):
-        return hash(self.pattern)
+        return self._hash
 
     def __eq__(self, other):
-        return self.pattern == other.pattern
+        if self is other:
+            return True
+        if not isinstance(other, Pattern):
+            return NotImplemented
+        return self._key == other._key
 
     def __add__(self, other):
         pattern = self.pattern
@@ -91,64 +191,231 @@ class Pattern:
             return None
 
 
-def get_distance_ratios(word, group, pick_last=5):
-    for a_word in group[-pick_last:]:
-        ratio = lev.ratio(word, a_word)
-        yield ratio
+class RatioCache:
+    """
+    A bounded cache of the Levenshtein ratios of pairs of words,
+    so that the pairs which are compared again in every round of grouping are only computed once.
+    The ratio is symmetric, so every pair is stored once, and the least recently used pairs are evicted.
+    """
+
+    def __init__(self, max_size=RATIO_CACHE_SIZE):
+        self.max_size = max_size
+        self._ratios = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _store(self, key, ratio):
+        if self.max_size:
+            self._ratios[key] = ratio
+            if len(self._ratios) > self.max_size:
+                self._ratios.popitem(last=False)
+                self.evictions += 1
+
+    def ratio(self, word1, word2):
+        key = (word1, word2) if word1 <= word2 else (word2, word1)
+
+        try:
+            ratio = self._ratios[key]
+        except KeyError:
+            self.misses += 1
+            ratio = lev.ratio(word1, word2)
+            self._store(key, ratio)
+        else:
+            self.hits += 1
+            self._ratios.move_to_end(key)
+
+        return ratio
+
+    def ratios(self, word, candidates):
+        """
+        Like get_ratios, but only the ratios which aren't cached are computed (in a single call)
+        """
+        ratios = []
+        missing = []
+
+        for n, candidate in enumerate(candidates):
+            key = (word, candidate) if word <= candidate else (candidate, word)
+            ratio = self._ratios.get(key)
+            if ratio is None:
+                missing.append((n, key))
+            else:
+                self.hits += 1
+                self._ratios.move_to_end(key)
+            ratios.append(ratio)
+
+        if missing:
+            self.misses += len(missing)
+            computed = get_ratios(word, [candidates[n] for n, _ in missing])
+            for (n, key), ratio in zip(missing, computed):
+                ratios[n] = ratio
+                self._store(key, ratio)
+
+        return ratios
+
+    def __len__(self):
+        return len(self._ratios)
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit rate': self.hits / lookups if lookups else 0.0}
+
+    def __repr__(self):
+        return 'RatioCache({size} pairs, {hits} hits, {misses} misses)'.format(**self.stats)
+
+
+def get_ratios(word, candidates, score_cutoff=None):
+    """
+    Compute the Levenshtein ratios of the word and every one of the candidates in a single call
+    (the ratios are the same as lev.ratio gives for every pair)
+    :param word:
+    :param candidates: a list of words
+    :param score_cutoff: if given, the ratios below it may be returned as 0
+    :return: a list of the ratios, in the order of the candidates
+    """
+    if rf_process is None or len(candidates) < 2:
+        return [lev.ratio(word, candidate) for candidate in candidates]
+
+    ratios = [0.0] * len(candidates)
+    for _, ratio, n in rf_process.extract(word, candidates, scorer=Indel.normalized_similarity,
+                                          processor=None, limit=None, score_cutoff=score_cutoff):
+        ratios[n] = ratio
+    return ratios
+
 
+def get_distance_ratios(word, group, pick_last=5, cache=None):
+    candidates = group[-pick_last:]
+    if cache is None:
+        return get_ratios(word, candidates)
+    return cache.ratios(word, candidates)
 
-def group_by_distance(words, groups=None):
+
+def is_close(word, group, pick_last=5, cache=None):
     """
-    Group words together based on Levenshtein distance
-    :param words:
+    :return: whether the word is close enough to all of the last words of the group
+    """
+    # most words are rejected by the first word they are compared with,
+    # so the others are only compared with the word (in one call) if it passes
+    first_ratio = lev.ratio(word, group[-1]) if cache is None else cache.ratio(word, group[-1])
+    if first_ratio < MIN_RATIO:
+        return False
+
+    others = group[-pick_last:-1]
+    if cache is None:
+        ratios = get_ratios(word, others, score_cutoff=MIN_RATIO)
+    else:
+        ratios = cache.ratios(word, others)
+    return all(ratio >= MIN_RATIO for ratio in ratios)
+
+
+def merge_singletons(groups, cache=None, pick_last=5):
+    """
+    Make sure there are no singleton groups at the end,
+    by moving every single word to the group with the closest words
+    (the word is compared with the last words of all the other groups in one call)
     :param groups:
+    :param cache: a RatioCache
+    :param pick_last: how many of the last words of every group the word is compared with
     :return:
     """
-    if not words:
-        # make sure there are no singleton groups at the end
-        singleton_groups = [group for group in groups if len(group) == 1]
-        for group in singleton_groups:
-            word = group[0]
-            other_groups = ((g, n) for n, g in enumerate(groups) if word not in g)
-            distance_ratio = functools.partial(get_distance_ratios, word)
+    singleton_groups = [group for group in groups if len(group) == 1]
+    for group in singleton_groups:
+        word = group[0]
+        other_groups = [(g[-pick_last:], n) for n, g in enumerate(groups) if word not in g]
+        candidates = [a_word for last_words, _ in other_groups for a_word in last_words]
+        if cache is None:
+            ratios = get_ratios(word, candidates)
+        else:
+            ratios = cache.ratios(word, candidates)
 
-            try:
-                closest_key = lambda item: statistics.mean(distance_ratio(item[0]))
-                closest_group, closest_index = max(other_groups, key=closest_key)
-            except ValueError:
-                continue
+        group_ratios = []
+        start = 0
+        for last_words, _ in other_groups:
+            group_ratios.append(ratios[start:start + len(last_words)])
+            start += len(last_words)
+
+        if not group_ratios or not all(group_ratios):
+            continue
 
-            groups[closest_index].append(word)
-            groups.remove(group)
+        # statistics.mean is exact but slow, so it only decides between the groups
+        # whose mean ratios are too close to tell apart with floats
+        approximate_means = [math.fsum(some_ratios) / len(some_ratios) for some_ratios in group_ratios]
+        best_mean = max(approximate_means)
+        close_enough = [n for n, mean in enumerate(approximate_means) if mean >= best_mean - 1e-9]
+        closest = max(close_enough, key=lambda n: statistics.mean(group_ratios[n]))
 
+        groups[other_groups[closest][1]].append(word)
+        groups.remove(group)
 
-        return groups
+    return groups
 
+
+def group_by_distance(words, groups=None, cache=None):
+    """
+    Group words together based on Levenshtein distance
+    :param words:
+    :param groups:
+    :param cache: a RatioCache
+    :return:
+    """
     if not groups:
         groups = []
 
-    current_group = []
-    words_left = []
+    while words:
+        current_group = []
+        words_left = []
 
-    for word in words:
-        if not current_group:
-            current_group.append(word)
-        else:
-            add_to_this = True
-            distance_ratios = get_distance_ratios(word, current_group)
-            for ratio in distance_ratios:
-                if ratio < 0.39:
-                    add_to_this = False
-                    break
-
-            if add_to_this:
+        for word in words:
+            if not current_group:
+                current_group.append(word)
+            elif is_close(word, current_group, cache=cache):
                 current_group.append(word)
             else:
                 # check if it fits with any of the existing groups
                 words_left.append(word)
 
-    groups.append(current_group)
-    return group_by_distance(words_left, groups)
+        groups.append(current_group)
+        words = words_left
+
+    return merge_singletons(groups, cache)
+
+
+def group_by_minhash(words, index=None, cache=None):
+    """
+    Group words together based on Levenshtein distance,
+    looking up the candidate groups for each word in MinHash LSH buckets
+    instead of comparing it with every group in turn.
+    A word joins the first candidate group whose last words are all close enough to it
+    (the same test as in group_by_distance), or starts a new group.
+    :param words:
+    :param index: a minhash.LSHIndex (a new one is made by default)
+    :param cache: a RatioCache
+    :return:
+    """
+    if index is None:
+        index = minhash.LSHIndex()
+
+    groups = []
+
+    for word in words:
+        for n in index.query(word):
+            if is_close(word, groups[n], cache=cache):
+                groups[n].append(word)
+                break
+        else:
+            n = len(groups)
+            groups.append([word])
+
+        index.add(word, n)
+
+    return merge_singletons(groups, cache)
+
+
+GROUPINGS = {'distance': group_by_distance,
+             'minhash': group_by_minhash}
 
 
 def find_matches(pattern, words):
@@ -156,82 +423,225 @@ def find_matches(pattern, words):
     return positive_results
 
 
-def find_all_matches(patterns, words):
-    pattern_variations = defaultdict(set)
+def match_all(patterns, words, instrument=NO_INSTRUMENTATION):
+    """
+    Match every pattern against every word in one pass over the words
+    (see automaton.PatternMatcher)
+    :return: a dict of every pattern and the set of words it matches
+    """
+    matcher = PatternMatcher(patterns)
+    instrument.count('automaton passes', len(words))
+    instrument.count('regex evaluations', matcher.num_fallback * len(words))
+    return matcher.match_sets(words)
 
-    for pattern in patterns:
-        #variations = get_substrings(pattern)
-        variation = pattern
 
-        # for variation in variations:
-        matches = set(find_matches(variation, words))
-        if matches:
-            pattern_variations[variation].update(matches)
+def find_all_matches(patterns, words, instrument=NO_INSTRUMENTATION, memory_pool=None):
+    """
+    :return: a dict of the patterns which match any of the words and the sets of words they match,
+        or a MatchStore in the memory_pool (see regexi.matchstore) if one is given
+    """
+    if memory_pool is not None:
+        # matching a batch at a time, so that only one batch of sets is in memory besides the store
+        matched = match_in_batches(patterns, words, instrument=instrument)
+        return MatchStore(memory_pool, ((pattern, matches) for pattern, matches in matched if matches))
 
+    pattern_variations = defaultdict(set)
+
+    for pattern, matches in match_all(patterns, words, instrument).items():
+        if matches:
+            pattern_variations[pattern].update(matches)
 
     return pattern_variations
 
 
+def keep_best_candidates(matched, max_candidates, pair_counts=None, weights=None,
+                         instrument=NO_INSTRUMENTATION):
+    """
+    Only keep the max_candidates most promising patterns,
+    by the number of words they match times the log of their length
+    (the factor of their score before their overlaps with the other patterns are considered),
+    and then by the number of pairs of words they were found in.
+    :param matched: an iterable of (pattern, the set of words it matches)
+    :param max_candidates: the size of the pool
+    :param pair_counts: a Counter of the number of pairs of words every pattern was found in
+    :param weights: the frequencies of the words (if they should count towards the scores)
+    :param instrument:
+    :return: a dict of the patterns kept (in the order they were given) and the sets of words they match
+    """
+    if pair_counts is None:
+        pair_counts = Counter()
+
+    pool = []
+    order = 0
+
+    for pattern, matches in matched:
+        order += 1
+        if not matches:
+            continue
+
+        pre_score = count_words(matches, weights) * math.log2(len(pattern))
+        # the earlier of two equally promising patterns is kept
+        item = ((pre_score, pair_counts[pattern], -order), pattern, matches)
+
+        if len(pool) < max_candidates:
+            heapq.heappush(pool, item)
+        else:
+            heapq.heappushpop(pool, item)
+
+    instrument.count('pruned candidates', order - len(pool))
+
+    pool.sort(key=lambda item: -item[0][2])
+    return {pattern: matches for _, pattern, matches in pool}
 
-def collapse_subsets(patterns: dict):
 
-    superpatterns = defaultdict(set)
+def match_in_batches(candidates, words, batch_size=1000, instrument=NO_INSTRUMENTATION):
+    """
+    Match the candidates against the words a batch at a time
+    :return: an iterator of (pattern, the set of words it matches)
+    """
+    candidates = iter(candidates)
+    while True:
+        batch = list(itertools.islice(candidates, batch_size))
+        if not batch:
+            return
+        yield from match_all(batch, words, instrument).items()
+
+
+def get_candidate_pool(candidates, words, max_candidates, pair_counts=None, weights=None,
+                       batch_size=1000, instrument=NO_INSTRUMENTATION):
+    """
+    Like find_all_matches, but only keep the max_candidates most promising patterns
+    (see keep_best_candidates).
+    The candidates are matched in batches, so only the match sets of the patterns kept
+    and of one batch are ever in memory.
+    """
+    matched = match_in_batches(candidates, words, batch_size, instrument)
+    return keep_best_candidates(matched, max_candidates, pair_counts, weights, instrument)
+
+
+def collapse_subsets(patterns: dict, instrument=NO_INSTRUMENTATION, checkpoint=None, first_round=1,
+                     budget=None):
+    """
+    :param patterns: a dict of patterns and the sets of words they match, or a MatchStore
+        (then the patterns of every round go to a new store in the same pool,
+        and the sets are only read back from the disk to check whether one is a subset of another)
+    :param instrument:
+    :param checkpoint: a Checkpoint to save the patterns to after every round
+    :param first_round: the number of the first round (when resuming from a checkpoint)
+    :param budget: a Budget; once it runs out, the remaining patterns are kept as they are
+    :return:
+    """
+
+    if isinstance(patterns, MatchStore):
+        stored = True
+        new_patterns = patterns.empty
+        add_matches = MatchStore.add
+    else:
+        stored = False
+        new_patterns = lambda: defaultdict(set)
+        add_matches = lambda superpatterns, pattern, matches: superpatterns[pattern].update(matches)
+
+    given_patterns = patterns
+    superpatterns = new_patterns()
     # patterns_to_super = defaultdict(Counter)
 
     keep_going = True
-    i = 1
+    i = first_round
 
     while keep_going:
         # pattern_scores = dict(get_pattern_scores(patterns))
 
-        sorted_patterns = sorted(patterns.items(), key=lambda item: len(item[1]))
+        items = patterns.lazy_items() if stored else patterns.items()
+        sorted_patterns = sorted(items, key=lambda item: len(item[1]))
 
-        print('-----round {}-----'.format(i))
-        print(len(patterns), 'patterns remaining')
+        instrument.record('patterns per round', len(patterns))
         keep_going = False
+        merges = 0
 
         for pattern, matches in sorted_patterns:
+            if budget is not None and budget.exhausted():
+                add_matches(superpatterns, pattern, matches)
+                keep_going = False
+                continue
 
             for other_pattern, other_matches in reversed(sorted_patterns):
                 if pattern != other_pattern and matches != other_matches:
-                    superpattern = pattern + other_pattern
-                    # check if they can be combined
-
                     # EXPERIMENT
                     # if pattern_scores[pattern] > pattern_scores[other_pattern]:
                     #     break
                     #
                     # # experiment
 
-                    if matches.issubset(other_matches) and superpattern:
+                    # only combine the patterns (which is expensive) if one is a subset of the other
+                    if not matches.issubset(other_matches):
+                        continue
 
-                        superpatterns[superpattern].update(other_matches)
+                    # check if they can be combined
+                    superpattern = pattern + other_pattern
+                    if superpattern:
+
+                        add_matches(superpatterns, superpattern, other_matches)
 
                         keep_going = True
+                        merges += 1
                         # merge only a pair of patterns each time
                         break
             else:
-                superpatterns[pattern].update(matches)
+                add_matches(superpatterns, pattern, matches)
 
-        patterns, superpatterns = superpatterns, defaultdict(set)
+        instrument.record('merges per round', merges)
+        if stored and patterns is not given_patterns:
+            patterns.close()
+        patterns, superpatterns = superpatterns, new_patterns()
         i += 1
 
+        if checkpoint is not None and keep_going:
+            checkpoint.end_round(i, patterns)
+
+    instrument.count('collapse rounds', i - first_round)
+
     return patterns
 
-def get_pattern_scores(patterns: dict):
+def count_words(words, weights=None):
+    """
+    Count the words, taking their frequencies into account if weights are given.
+    :param words:
+    :param weights: a mapping of words to their frequencies (e.g. a Counter)
+    :return:
+    """
+    if weights is None:
+        return len(words)
+    return sum(weights[word] for word in words)
+
+
+def get_pattern_scores(patterns: dict, weights=None, instrument=NO_INSTRUMENTATION, only=None):
+    """
+    Score every pattern (or only some of them) against all the other patterns.
+    :param patterns: a dict of patterns and the sets of words they match (or a MatchStore)
+    :param weights: the frequencies of the words (if they should count towards the scores)
+    :param instrument:
+    :param only: the patterns to score (all of them by default)
+    :return:
+    """
 
     for pattern, words in patterns.items():
+        if only is not None and pattern not in only:
+            continue
+
+        instrument.count('pattern scores')
+        num_words = count_words(words, weights)
+
         match_scores = []
         for other_pattern, other_words in patterns.items():
             if pattern != other_pattern:
                 intersection = words.intersection(other_words)
-                score = len(intersection) / len(words)
+                score = count_words(intersection, weights) / num_words
                 match_scores.append(score)
 
         # one-element patterns should be discarded (because they aren't really patterns)
         # and overly long patterns should be demoted,
         # which is why we need to take a log of a pattern's length
-        score_factor = len(words) * math.log2(len(pattern))
+        score_factor = num_words * math.log2(len(pattern))
 
         try:
             pattern_score = score_factor / sum(match_scores)
@@ -244,6 +654,172 @@ def get_pattern_scores(patterns: dict):
 
 
 
+def get_promising_patterns(patterns: dict, n, weights=None):
+    """
+    Get the n patterns with the highest scores before their overlaps with the other patterns are considered
+    """
+    return set(heapq.nlargest(n, patterns, key=lambda pattern: count_words(patterns[pattern], weights)
+                                                               * math.log2(len(pattern))))
+
+
+def get_top_score(patterns: dict, weights=None, instrument=NO_INSTRUMENTATION, only=None):
+    """
+    Find the pattern with the highest score (the first one if several have it),
+    the same as max(get_pattern_scores(...)) would, but without finishing the scores which can't be the highest:
+    patterns whose score factor is 0 score 0 regardless of their overlaps,
+    and adding up a pattern's overlaps with the other patterns can only lower its score,
+    so that stops as soon as its score drops below the highest one so far.
+    :param patterns: a dict of patterns and the sets of words they match (or a MatchStore)
+    :param weights:
+    :param instrument:
+    :param only: the patterns to score (all of them by default)
+    :return: the top pattern and its score
+    """
+    if isinstance(patterns, MatchStore):
+        if not patterns.all_in_memory():
+            return get_top_score_in_blocks(patterns, weights, instrument, only)
+        # (none of the sets has to be read back, so there is no need to keep track of their use)
+        patterns = dict(patterns.items())
+
+    top_pattern, top_score = None, None
+
+    for pattern, words in patterns.items():
+        if only is not None and pattern not in only:
+            continue
+
+        num_words = count_words(words, weights)
+        score_factor = num_words * math.log2(len(pattern))
+
+        if not score_factor:
+            instrument.count('zero scores skipped')
+            pattern_score = score_factor
+        else:
+            instrument.count('pattern scores')
+            match_scores = []
+            overlaps = 0
+            cut_short = False
+
+            for other_pattern, other_words in patterns.items():
+                if pattern != other_pattern:
+                    intersection = words.intersection(other_words)
+                    score = count_words(intersection, weights) / num_words
+                    match_scores.append(score)
+
+                    # (with some leeway for rounding, since the final sum is added up separately)
+                    overlaps += score
+                    if top_score is not None and overlaps and \
+                            score_factor / overlaps < top_score * (1 - 1e-9):
+                        cut_short = True
+                        break
+
+            if cut_short:
+                instrument.count('scores cut short')
+                continue
+
+            try:
+                pattern_score = score_factor / sum(match_scores)
+            except ZeroDivisionError:
+                pattern_score = score_factor
+
+        if top_score is None or pattern_score > top_score:
+            top_pattern, top_score = pattern, pattern_score
+
+    if top_pattern is None:
+        raise ValueError('no patterns to score')
+
+    return top_pattern, top_score
+
+
+# the most patterns get_top_score_in_blocks scores at a time (the scores of those in the first block
+# can't be cut short, since there is no top score to compare them to yet)
+SCORED_BLOCK_SIZE = 64
+
+
+def get_top_score_in_blocks(patterns: MatchStore, weights=None, instrument=NO_INSTRUMENTATION, only=None):
+    """
+    Like get_top_score, but for the patterns in a MatchStore, where reading the set of every other pattern
+    back for every pattern would read all of them back as many times as there are patterns:
+    the patterns are scored a block at a time (as many as their sets fit in half the budget of the pool,
+    which are held on top of it), so every other set is only read back once for every block,
+    and not at all if it can't share any words with the sets of the block (by their signatures).
+    The overlaps of every pattern are added up in the same order as in get_top_score, so the scores are
+    the same, but a pattern's score can only be cut short by the top score of the blocks before it.
+    """
+    top_pattern, top_score = None, None
+    scored = [pattern for pattern in patterns if only is None or pattern in only]
+
+    start = 0
+    while start < len(scored):
+        # the pattern, its words, their number, its score factor, its overlaps (and their sum) so far,
+        # and whether its score was cut short
+        block = []
+        block_size = 0
+        signature = 0
+        for pattern in scored[start:]:
+            words = patterns[pattern]
+            size = sys.getsizeof(words)
+            if block and (block_size + size > patterns.pool.budget // 2 or len(block) >= SCORED_BLOCK_SIZE):
+                break
+            block_size += size
+
+            num_words = count_words(words, weights)
+            score_factor = num_words * math.log2(len(pattern))
+            if not score_factor:
+                instrument.count('zero scores skipped')
+            else:
+                instrument.count('pattern scores')
+                signature |= patterns.signature(pattern)
+            block.append([pattern, words, num_words, score_factor, [], 0, False])
+        start += len(block)
+
+        for other_pattern in patterns:
+            left = [item for item in block if item[3] and not item[6]]
+            if not left:
+                break
+
+            other_words = None
+            if patterns.signature(other_pattern) & signature:
+                other_words = patterns[other_pattern]
+
+            for item in left:
+                pattern, words, num_words, score_factor, match_scores, overlaps, _ = item
+                if pattern == other_pattern:
+                    continue
+                if other_words is None:
+                    intersection = ()
+                else:
+                    intersection = words.intersection(other_words)
+                score = count_words(intersection, weights) / num_words
+                match_scores.append(score)
+
+                overlaps += score
+                item[5] = overlaps
+                if top_score is not None and overlaps and \
+                        score_factor / overlaps < top_score * (1 - 1e-9):
+                    item[6] = True
+
+        for pattern, _, _, score_factor, match_scores, _, cut_short in block:
+            if cut_short:
+                instrument.count('scores cut short')
+                continue
+
+            if not score_factor:
+                pattern_score = score_factor
+            else:
+                try:
+                    pattern_score = score_factor / sum(match_scores)
+                except ZeroDivisionError:
+                    pattern_score = score_factor
+
+            if top_score is None or pattern_score > top_score:
+                top_pattern, top_score = pattern, pattern_score
+
+    if top_pattern is None:
+        raise ValueError('no patterns to score')
+
+    return top_pattern, top_score
+
+
 def make_groups(pattern_groups):
     for n, pattern_group in enumerate(pattern_groups):
         other = itertools.chain.from_iterable(pattern_groups[:n] + pattern_groups[n+1:])
@@ -257,12 +833,20 @@ def remove_group(pattern_words, pattern_groups):
     other_words = {word for word in all_words if word not in pattern_words}
     return other_words
 
-def get_patterns(words):
+def get_patterns(words, instrument=NO_INSTRUMENTATION, budget=None):
     patterns = Counter()
 
+    if budget is None:
+        instrument.count('pairs compared', count_pairs(len(words)))
+
     words_combinations = itertools.combinations(words, 2)
 
     for word1, word2 in words_combinations:
+        if budget is not None:
+            if not budget.spend():
+                break
+            instrument.count('pairs compared')
+
         pattern, _ = patternize.find_pattern((word1, word2))
         if pattern:
             pattern = Pattern(pattern)
@@ -270,58 +854,704 @@ def get_patterns(words):
 
     return patterns
 
-def get_regex_matches(pattern: Pattern, words):
+
+def get_substring_patterns(words, instrument=NO_INSTRUMENTATION, budget=None, min_support=2):
+    """
+    Find candidate patterns without comparing pairs of words:
+    the substrings (of at least two characters), prefixes and suffixes shared by the words
+    (see regexi.substrings), as patterns like .*ab.*, ^ab.* and .*ab$
+    :param words:
+    :param instrument:
+    :param budget: a Budget (no more patterns are found once it has run out)
+    :param min_support: the minimum number of words a substring must be shared by
+    :return: a Counter of the patterns and the numbers of words they were found in
+    """
+    patterns = Counter()
+    if budget is not None and budget.exhausted():
+        return patterns
+
+    automaton = SuffixAutomaton(words)
+    instrument.count('automaton states', len(automaton))
+
+    for substring, support in automaton.get_repeats(min_support, min_length=2):
+        patterns[Pattern([None] + list(substring) + [None])] += support
+    for prefix, support in get_shared_prefixes(words, min_support):
+        patterns[Pattern(list(prefix) + [None])] += support
+    for suffix, support in get_shared_prefixes(words, min_support, reverse=True):
+        patterns[Pattern([None] + list(suffix))] += support
+
+    return patterns
+
+
+# the ways of finding the candidate patterns in a group of words
+EXTRACTIONS = {'pairs': get_patterns,
+               'suffix': get_substring_patterns}
+
+
+class Budget:
+    """
+    A deadline and/or a limit on the work (the number of word pairs compared) for a whole run.
+    When it runs out, the stage which is running stops where it is,
+    and the best patterns found so far are returned.
+    """
+
+    def __init__(self, time_limit=None, max_pairs=None):
+        """
+        :param time_limit: the maximum number of seconds for the run (counted from its start)
+        :param max_pairs: the maximum number of word pairs to compare
+        """
+        self.time_limit = time_limit
+        self.max_pairs = max_pairs
+        self.deadline = None
+        self.pairs = 0
+        self.ran_out = False
+
+    def start(self):
+        if self.deadline is None and self.time_limit is not None:
+            self.deadline = time.monotonic() + self.time_limit
+
+    def exhausted(self):
+        if not self.ran_out:
+            if self.max_pairs is not None and self.pairs >= self.max_pairs:
+                self.ran_out = True
+            elif self.deadline is not None and time.monotonic() > self.deadline:
+                self.ran_out = True
+        return self.ran_out
+
+    def spend(self, pairs=1):
+        """
+        Take some work out of the budget
+        :return: whether there was enough of it left
+        """
+        if self.exhausted():
+            return False
+        self.pairs += pairs
+        return True
+
+    def __repr__(self):
+        return 'Budget({} pairs compared{})'.format(self.pairs, ', ran out' if self.ran_out else '')
+
+
+class Result(list):
+    """
+    A list of patterns, which also tells whether the run was completed
+    or whether it was cut short by its Budget
+    """
+
+    def __init__(self, patterns=(), completed=True):
+        super().__init__(patterns)
+        self.completed = completed
+
+
+class Sampling:
+    """
+    The settings of the approximate mode, in which candidate patterns are only generated
+    from a sample of the word pairs in each group, and the report of how much was sampled.
+    The budget and the time limit apply to every round of candidate generation
+    (i.e. to every iteration of get_top_patterns), and the report to the latest run
+    (so the same settings can be used for several runs).
+    """
+
+    def __init__(self, budget=None, time_limit=None, seed=None):
+        """
+        :param budget: the maximum number of word pairs to compare
+        :param time_limit: the maximum number of seconds to spend comparing word pairs
+        :param seed: the seed for picking the pairs
+        """
+        self.budget = budget
+        self.time_limit = time_limit
+        self.random = random.Random(seed)
+
+        self.start()
+
+    def start(self):
+        """
+        Clear the report (at the start of a run)
+        """
+        self.sampled_pairs = 0
+        self.total_pairs = 0
+        self.timed_out = False
+
+    @property
+    def coverage(self):
+        try:
+            return self.sampled_pairs / self.total_pairs
+        except ZeroDivisionError:
+            return 1.0
+
+    def __repr__(self):
+        return 'Sampling({} of {} pairs, {:.1%})'.format(self.sampled_pairs, self.total_pairs,
+                                                        self.coverage)
+
+
+def count_pairs(num_words):
+    return num_words * (num_words - 1) // 2
+
+
+def get_pair(index, num_words):
+    """
+    Get the pair of word indexes at the given position of itertools.combinations(range(num_words), 2)
+    """
+    i = num_words - 2 - (math.isqrt(4 * num_words * (num_words - 1) - 8 * index - 7) - 1) // 2
+    j = index + i + 1 - count_pairs(num_words) + count_pairs(num_words - i)
+    return i, j
+
+
+def sample_pair_indexes(num_pairs, rng):
+    """
+    Yield every pair index once in random order,
+    only keeping as many indexes in memory as have been yielded.
+    """
+    seen = set()
+
+    # pick indexes at random while that is still cheap
+    while len(seen) < num_pairs // 2:
+        index = rng.randrange(num_pairs)
+        if index not in seen:
+            seen.add(index)
+            yield index
+
+    remaining = [index for index in range(num_pairs) if index not in seen]
+    rng.shuffle(remaining)
+    yield from remaining
+
+
+def get_sampled_patterns(groups, sampling: Sampling, rounds=100, instrument=NO_INSTRUMENTATION,
+                         budget=None):
+    """
+    Like get_patterns, but only for a sample of the word pairs in every group.
+    The budget is split between the groups according to how many pairs each group has
+    (but every group with any pairs gets at least one, so with many small groups a few more pairs
+    than the budget may be compared), and the groups take turns so that a time limit cuts all of them
+    short evenly.
+    :param groups:
+    :param sampling:
+    :param rounds: the number of turns in which every group's sample is processed
+    :param instrument:
+    :param budget: a Budget for the whole run
+    :return:
+    """
+    patterns = Counter()
+
+    groups = [list(group) for group in groups]
+    group_pairs = [count_pairs(len(group)) for group in groups]
+    total_pairs = sum(group_pairs)
+    sampling.total_pairs += total_pairs
+
+    if sampling.budget is None or sampling.budget >= total_pairs:
+        quotas = group_pairs
+    else:
+        # (rounding alone would leave the small groups out altogether)
+        quotas = [min(num_pairs, max(1, round(sampling.budget * num_pairs / total_pairs)))
+                  for num_pairs in group_pairs]
+
+    samples = []
+    for group, num_pairs, quota in zip(groups, group_pairs, quotas):
+        if quota:
+            indexes = itertools.islice(sample_pair_indexes(num_pairs, sampling.random), quota)
+            samples.append((group, indexes, math.ceil(quota / rounds)))
+
+    if sampling.time_limit is not None:
+        deadline = time.monotonic() + sampling.time_limit
+    else:
+        deadline = None
+
+    while samples:
+        for sample in list(samples):
+            group, indexes, chunk_size = sample
+            chunk = list(itertools.islice(indexes, chunk_size))
+            if not chunk:
+                samples.remove(sample)
+                continue
+
+            for index in chunk:
+                if budget is not None and not budget.spend():
+                    return patterns
+
+                i, j = get_pair(index, len(group))
+                pattern, _ = patternize.find_pattern((group[i], group[j]))
+                if pattern:
+                    patterns[Pattern(pattern)] += 1
+                sampling.sampled_pairs += 1
+                instrument.count('pairs compared')
+
+                if deadline is not None and time.monotonic() > deadline:
+                    sampling.timed_out = True
+                    return patterns
+
+    return patterns
+
+
+class Checkpoint:
+    """
+    Saves the state of a run (the words left, the top patterns found so far
+    and the patterns of the current round of collapsing) to a gzipped JSON file every so often,
+    so that a run which was interrupted can be resumed with Checkpoint.load.
+    Every word is stored only once, and referred to by its id everywhere else.
+    """
+
+    def __init__(self, path, interval=60):
+        """
+        :param path: the file to save to (it is replaced atomically on every save)
+        :param interval: the minimum number of seconds between saves (0 saves at every opportunity)
+        """
+        self.path = Path(path)
+        self.interval = interval
+
+        self.weighted = None
+        self.vocabulary = None
+        self.words = None
+        self.top_patterns = []
+        self.collapse_state = None
+
+        self.saves = 0
+        self.seconds = 0.0
+        self._word_ids = None
+        self._last_save = time.monotonic()
+
+    def _set_vocabulary(self, vocabulary):
+        self.vocabulary = vocabulary
+        self._word_ids = {word: n for n, (word, _) in enumerate(vocabulary)}
+
+    def start(self, words, weighted=False):
+        """
+        Begin a new run, or continue the one that was loaded.
+        :param words: a Counter of all the words
+        :param weighted:
+        :return: the words left and the top patterns found so far
+        """
+        if self.vocabulary is None:
+            self.weighted = weighted
+            self._set_vocabulary([[word, count] for word, count in words.items()])
+            return words, []
+
+        if weighted != self.weighted:
+            raise ValueError('the checkpoint was made with weighted={}'.format(self.weighted))
+        if len(words) != len(self.vocabulary) or any(word not in words
+                                                     for word, _ in self.vocabulary):
+            raise ValueError('the checkpoint was made for a different list of words')
+
+        return self.words, self.top_patterns
+
+    def begin_iteration(self, words, top_patterns):
+        self.words = list(words)
+        self.top_patterns = list(top_patterns)
+        self.collapse_state = None
+        self.maybe_save()
+
+    def end_round(self, next_round, patterns):
+        self.collapse_state = next_round, patterns
+        self.maybe_save()
+
+    def resume_collapse(self):
+        """
+        :return: the round and the patterns to continue collapsing from (only once), or None
+        """
+        state, self.collapse_state = self.collapse_state, None
+        return state
+
+    def maybe_save(self):
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        start = time.perf_counter()
+        word_ids = self._word_ids
+
+        state = {'version': CHECKPOINT_VERSION,
+                 'weighted': self.weighted,
+                 'vocabulary': self.vocabulary,
+                 'words': [word_ids[word] for word in self.words],
+                 'top_patterns': [[pattern.to_json(), score]
+                                  for pattern, score in self.top_patterns],
+                 'collapse': None}
+
+        if self.collapse_state is not None:
+            next_round, patterns = self.collapse_state
+            state['collapse'] = {'round': next_round,
+                                 'patterns': [[pattern.to_json(),
+                                               sorted(word_ids[word] for word in matches)]
+                                              for pattern, matches in patterns.items()]}
+
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with gzip.open(str(temp_path), 'wt', encoding='utf-8', compresslevel=1) as file:
+            json.dump(state, file, ensure_ascii=False)
+        os.replace(str(temp_path), str(self.path))
+
+        self.saves += 1
+        self.seconds += time.perf_counter() - start
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, path, interval=60):
+        with gzip.open(str(path), 'rt', encoding='utf-8') as file:
+            state = json.load(file)
+
+        if state['version'] != CHECKPOINT_VERSION:
+            raise ValueError('unsupported checkpoint version {}'.format(state['version']))
+
+        checkpoint = cls(path, interval)
+        checkpoint.weighted = state['weighted']
+        checkpoint._set_vocabulary(state['vocabulary'])
+
+        words = [word for word, _ in checkpoint.vocabulary]
+        checkpoint.words = [words[n] for n in state['words']]
+        checkpoint.top_patterns = [(Pattern.from_json(elements), score)
+                                   for elements, score in state['top_patterns']]
+
+        if state['collapse'] is not None:
+            patterns = {Pattern.from_json(elements): {words[n] for n in word_ids}
+                        for elements, word_ids in state['collapse']['patterns']}
+            checkpoint.collapse_state = state['collapse']['round'], patterns
+
+        return checkpoint
+
+
+def get_regex_matches(pattern: Pattern, words, instrument=NO_INSTRUMENTATION):
+    instrument.count('regex evaluations', len(words))
     for word in words:
         if re.match(pattern.regex, word):
             yield word
 
 
-def get_top_patterns(words, top_patterns=None):
-    # for debug
-    print = pprint.pprint
-    ###
-    if not words:
-        return top_patterns
-
+def iter_top_patterns(words, top_patterns=None, weights=None, sampling=None,
+                      grouping=group_by_distance, instrument=NO_INSTRUMENTATION, checkpoint=None,
+                      budget=None, max_candidates=None, prune=False, shards=None, ratio_cache=None,
+                      extraction=get_patterns, memory_pool=None, verbose=False):
+    """
+    Find the best pattern in the words, take out the words it matches, and repeat
+    until no words are left or no pattern has a positive score.
+    Every pattern is yielded as soon as it is found (and also appended to top_patterns).
+    :param words:
+    :param top_patterns: the top patterns found so far
+    :param weights: the frequencies of the words (if they should count towards the scores)
+    :param sampling: a Sampling for the approximate mode
+    :param grouping: the function which groups the words
+    :param instrument: an Instrumentation to report the stages and counters to
+    :param checkpoint: a Checkpoint to save the progress to (and to resume the collapsing from)
+    :param budget: a Budget for the run; if it runs out, the candidates found until then
+        are still matched and scored, and the best of them is the last pattern returned
+    :param max_candidates: only keep this many of the most promising candidate patterns in every round
+        (see get_candidate_pool)
+    :param prune: drop the candidates with a single element before matching them,
+        since their score is always 0 (this is faster, but they can no longer be combined
+        with other patterns while collapsing, or lower the scores of the patterns they overlap with)
+    :param shards: a shard.ShardedExecutor to extract and match the candidate patterns
+        in other processes (the sampling and the budget don't apply to it)
+    :param ratio_cache: a RatioCache which the grouping function shares between the rounds
+    :param extraction: the function which finds the candidate patterns in a group of words
+        (see EXTRACTIONS; the sampling and the shards only work with get_patterns)
+    :param memory_pool: a matchstore.MemoryPool to keep the sets of words the patterns match in
+        while they are collapsed and scored, so that those which don't fit in its budget are kept on disk
+    :param verbose:
+    :return: yields (pattern, score, the set of words it matches) tuples, where the words are those
+        which were left in the round the pattern was found in (the set is the one used to take them out,
+        so it shouldn't be changed); returns whether the run was completed (rather than cut short)
+    """
     if top_patterns is None:
         top_patterns = []
 
-    __builtins__.print('{} words'.format(len(words)))
+    if extraction is not get_patterns and (sampling is not None or shards is not None):
+        raise ValueError('the sampling and the shards only work with the patterns from pairs of words')
+
+    if budget is not None:
+        budget.start()
+    if sampling is not None:
+        sampling.start()
+    completed = True
+
+    # a loaded checkpoint may have been saved in the middle of collapsing
+    resumed = checkpoint.resume_collapse() if checkpoint is not None else None
+
+    while words:
+        if budget is not None and budget.exhausted():
+            completed = False
+            break
+
+        instrument.count('iterations')
+        instrument.record('words per iteration', len(words))
+
+        if verbose:
+            print('{} words'.format(len(words)))
+
+        if memory_pool is not None:
+            # (the sets of the previous iteration are all closed by now)
+            memory_pool.set_words(words)
+
+        if resumed is None:
+            if checkpoint is not None:
+                checkpoint.begin_iteration(words, top_patterns)
+
+            with instrument.stage('grouping'):
+                if ratio_cache is None:
+                    groups = grouping(words)
+                else:
+                    groups = grouping(words, cache=ratio_cache)
+
+            with instrument.stage('pair extraction'):
+                if shards is not None:
+                    # the patterns from all the groups come back as one Counter
+                    group_patterns = [shards.extract(groups)]
+                elif sampling is None:
+                    group_patterns = (extraction(group, instrument, budget) for group in groups)
+                else:
+                    group_patterns = [get_sampled_patterns(groups, sampling, instrument=instrument,
+                                                           budget=budget)]
+
+                if max_candidates is None:
+                    candidates = set(itertools.chain.from_iterable(group_patterns))
+                else:
+                    pair_counts = Counter()
+                    for found in group_patterns:
+                        pair_counts.update(found)
+                    candidates = set(pair_counts)
+
+                if prune:
+                    num_candidates = len(candidates)
+                    candidates = {pattern for pattern in candidates if len(pattern) > 1}
+                    instrument.count('single-element candidates pruned',
+                                     num_candidates - len(candidates))
+
+            instrument.count('candidate patterns', len(candidates))
+
+            # the candidates are verified against all the words, not only the sampled ones
+            with instrument.stage('matching'):
+                if shards is not None:
+                    matched = shards.match(candidates, words)
+                    if max_candidates is not None:
+                        patterns = keep_best_candidates(matched, max_candidates, pair_counts,
+                                                        weights, instrument)
+                    elif memory_pool is not None:
+                        patterns = MatchStore(memory_pool, ((pattern, matches)
+                                                            for pattern, matches in matched if matches))
+                    else:
+                        patterns = {pattern: matches for pattern, matches in matched if matches}
+                elif max_candidates is None:
+                    patterns = find_all_matches(candidates, words, instrument, memory_pool)
+                else:
+                    patterns = get_candidate_pool(candidates, words, max_candidates, pair_counts,
+                                                  weights, instrument=instrument)
+
+            first_round = 1
+        else:
+            first_round, patterns = resumed
+            resumed = None
+
+        if memory_pool is not None and not isinstance(patterns, MatchStore):
+            # the pool of candidates or the patterns loaded from a checkpoint
+            patterns = MatchStore(memory_pool, patterns.items())
+
+        with instrument.stage('collapsing'):
+            collapsed = collapse_subsets(patterns, instrument, checkpoint, first_round, budget)
+
+        with instrument.stage('rematching'):
+            if memory_pool is None:
+                patterns = match_all(collapsed, words, instrument)
+            else:
+                patterns.close()
+                patterns = MatchStore(memory_pool, match_in_batches(collapsed, words, instrument=instrument))
+                collapsed.close()
+
+        with instrument.stage('scoring'):
+            if budget is not None and budget.exhausted():
+                # the patterns may not have been collapsed, so only the most promising ones are scored
+                only = get_promising_patterns(patterns, BUDGET_SCORED_PATTERNS, weights)
+            else:
+                only = None
+            try:
+                top_pattern, score = get_top_score(patterns, weights, instrument, only)
+            except ValueError:
+                score = 0
+
+        if score <= 0:
+            # no pattern is left to take out, which only ends the run
+            # if the budget didn't cut the round short before the patterns were found
+            if budget is not None and budget.exhausted():
+                instrument.count('budget ran out')
+                completed = False
+            break
 
-    groups = group_by_distance(words)
+        top_patterns.append((top_pattern, score))
 
-    all_patterns = itertools.chain.from_iterable(get_patterns(group) for group in groups)
-    patterns = find_all_matches(set(all_patterns), words)
+        if verbose:
+            pprint.pprint((top_pattern, score))
 
-    patterns = collapse_subsets(patterns)
-    patterns = {pattern: set(get_regex_matches(pattern, words))
-                for pattern in patterns}
+        top_matches = patterns[top_pattern]
+        words = remove_group(top_matches, patterns)
+        if memory_pool is not None:
+            patterns.close()
+        yield top_pattern, score, top_matches
 
-    uniqueness_scores = get_pattern_scores(patterns)
-    try:
-        top_pattern, score = max(uniqueness_scores, key=lambda item: item[1])
-        if score > 0:
-            top_patterns.append((top_pattern, score))
-        else:
-            raise ValueError
-    except ValueError:
-        return top_patterns
+        if budget is not None and budget.exhausted():
+            instrument.count('budget ran out')
+            completed = False
+            break
 
-    print((top_pattern, score))
+    return completed
 
-    other_words = remove_group(patterns[top_pattern], patterns)
-    return get_top_patterns(other_words, top_patterns)
 
-def run(words):
+def get_top_patterns(words, top_patterns=None, **kwargs):
+    """
+    Like iter_top_patterns, but only returns when all the patterns have been found
+    :param words:
+    :param top_patterns: the top patterns found so far
+    :param kwargs: the other arguments of iter_top_patterns
+    :return: a Result with (pattern, score) tuples
+    """
+    if top_patterns is None:
+        top_patterns = []
+
+    found = iter_top_patterns(words, top_patterns, **kwargs)
+    while True:
+        try:
+            next(found)
+        except StopIteration as stop:
+            return Result(top_patterns, stop.value)
+
+
+def get_cache_key(result_cache, words, weighted, sampling, grouping, max_candidates, prune, extraction):
+    """
+    :return: the key of the result of a run in the result_cache, or None if it shouldn't be cached
+        (when pairs are sampled for a limited time, the result depends on how fast they are compared,
+        and a grouping or extraction function other than those in GROUPINGS and EXTRACTIONS
+        has no name which is sure to tell it apart from others, like a lambda or a partial)
+    """
+    if sampling is not None and sampling.time_limit is not None:
+        return None
+
+    grouping_name = next((name for name, function in GROUPINGS.items() if function is grouping), None)
+    extraction_name = next((name for name, function in EXTRACTIONS.items() if function is extraction), None)
+    if grouping_name is None or extraction_name is None:
+        return None
+
+    # the words are grouped in the order they were given (which changes the result),
+    # and their frequencies only matter if they are weighted
+    data = list(words.items()) if weighted else list(words)
+    params = {'weighted': weighted, 'grouping': grouping_name, 'max_candidates': max_candidates,
+              'prune': prune, 'extraction': extraction_name}
+    if sampling is not None:
+        # (the state of its random generator decides which pairs are sampled)
+        params['sampling'] = {'budget': sampling.budget, 'random': sampling.random.getstate()}
+
+    return result_cache.key('classify', data, params)
+
+
+def run(words, weighted=False, sampling=None, grouping=group_by_distance,
+        instrument=NO_INSTRUMENTATION, checkpoint=None, budget=None, max_candidates=None,
+        prune=False, shards=None, ratio_cache=None,
+        extraction=get_patterns, memory_pool=None, result_cache=None, verbose=False):
+    """
+    Find the top patterns in the words.
+    Duplicate words are only processed once.
+    :param words: a list of words or a Counter of words and their frequencies
+    :param weighted: whether the frequencies of the words should count towards the scores of patterns
+    :param sampling: a Sampling for the approximate mode (None compares every pair of words)
+    :param grouping: the function which groups the words before finding the candidate patterns
+    :param instrument: an Instrumentation to report the stages and counters to
+    :param checkpoint: a Checkpoint to save the progress to
+        (if it was loaded from a file, the run continues from where it was saved)
+    :param budget: a Budget which cuts the run short (see Result.completed)
+    :param max_candidates: the maximum number of candidate patterns kept in every round (all by default)
+    :param prune: drop the candidates which can only score 0 before matching them
+    :param shards: a shard.ShardedExecutor to extract and match the candidates in other processes
+    :param ratio_cache: a RatioCache for the Levenshtein ratios of the words (a new one by default)
+    :param extraction: the function which finds the candidate patterns in a group of words
+        (get_patterns compares every pair of words, get_substring_patterns finds the shared substrings)
+    :param memory_pool: a matchstore.MemoryPool to keep the sets of words the candidate patterns match in
+        (all of them are kept in memory by default)
+    :param result_cache: a resultcache.ResultCache to look the result up in (and store it in,
+        if the run is completed)
+    :param verbose:
+    :return: a Result with (pattern, matches) tuples
+    """
     # words = sorted(words)
 
-    patterns = dict(get_top_patterns(words))
+    if not isinstance(words, Mapping):
+        words = Counter(words)
+
+    weights = words if weighted else None
+
+    cache_key = None
+    if result_cache is not None:
+        cache_key = get_cache_key(result_cache, words, weighted, sampling, grouping, max_candidates,
+                                  prune, extraction)
+    if cache_key is not None:
+        stored = result_cache.get(cache_key)
+        if stored is not None:
+            instrument.count('result cache hits')
+            return Result([(Pattern.from_json(elements), matches) for elements, matches in stored], True)
+
+    if ratio_cache is None:
+        ratio_cache = RatioCache()
+
+    if checkpoint is not None:
+        words_left, top_patterns = checkpoint.start(words, weighted)
+    else:
+        words_left, top_patterns = words, None
+
+    top_patterns = get_top_patterns(words_left, top_patterns, weights=weights, sampling=sampling,
+                                    grouping=grouping, instrument=instrument, checkpoint=checkpoint,
+                                    budget=budget, max_candidates=max_candidates, prune=prune,
+                                    shards=shards, ratio_cache=ratio_cache, extraction=extraction,
+                                    memory_pool=memory_pool, verbose=verbose)
+    patterns = dict(top_patterns)
+
+    instrument.count('ratio cache hits', ratio_cache.hits)
+    instrument.count('ratio cache misses', ratio_cache.misses)
+    instrument.count('ratio cache evictions', ratio_cache.evictions)
+    if memory_pool is not None:
+        instrument.count('match sets spilled', memory_pool.spills)
+        instrument.count('match sets paged in', memory_pool.page_ins)
     patterns_and_matches = ((pattern, list(get_regex_matches(pattern, words)))
                             for pattern in patterns)
 
     sorted_patterns = sorted(patterns_and_matches, key=lambda item: patterns[item[0]],
                              reverse=True)
-    return sorted_patterns
+
+    # (the budget isn't part of the key, so a result it cut short would be returned for runs without one)
+    if cache_key is not None and top_patterns.completed and not (budget is not None and budget.ran_out):
+        result_cache.put(cache_key, [[pattern.to_json(), matches] for pattern, matches in sorted_patterns])
+
+    return Result(sorted_patterns, top_patterns.completed)
+
+
+def stream_patterns(words, weighted=False, sampling=None, grouping=group_by_distance,
+                    instrument=NO_INSTRUMENTATION, checkpoint=None, budget=None, max_candidates=None,
+                    prune=False, shards=None, ratio_cache=None,
+                    extraction=get_patterns, memory_pool=None, verbose=False):
+    """
+    Like run, but yields every top pattern as soon as it is found, in the order they are found
+    (the patterns found before a checkpoint was saved are not yielded again when resuming from it).
+    The words every pattern matches are not matched again: they are the words which were left
+    when it was found, rather than all the words it matches.
+    :param words: a list of words or a Counter of words and their frequencies
+    :return: yields (pattern, score, the set of words it matches) tuples
+    """
+    if not isinstance(words, Mapping):
+        words = Counter(words)
+
+    weights = words if weighted else None
+
+    if ratio_cache is None:
+        ratio_cache = RatioCache()
+
+    if checkpoint is not None:
+        words_left, top_patterns = checkpoint.start(words, weighted)
+    else:
+        words_left, top_patterns = words, None
+
+    yield from iter_top_patterns(words_left, top_patterns, weights=weights, sampling=sampling,
+                                 grouping=grouping, instrument=instrument, checkpoint=checkpoint,
+                                 budget=budget, max_candidates=max_candidates, prune=prune,
+                                 shards=shards, ratio_cache=ratio_cache, extraction=extraction,
+                                 memory_pool=memory_pool, verbose=verbose)
+
+    instrument.count('ratio cache hits', ratio_cache.hits)
+    instrument.count('ratio cache misses', ratio_cache.misses)
+    instrument.count('ratio cache evictions', ratio_cache.evictions)
+    if memory_pool is not None:
+        instrument.count('match sets spilled', memory_pool.spills)
+        instrument.count('match sets paged in', memory_pool.page_ins)
 
 
 
@@ -329,24 +1559,140 @@ def run(words):
 
 if __name__ == '__main__':
     arg_parser = ArgumentParser()
-    arg_parser.add_argument('words', help='the file with words')
+    arg_parser.add_argument('words', help='the file with words (or a compiled corpus)')
     arg_parser.add_argument('--casefold', action='store_true',
                             help='ignore case in the input data')
     arg_parser.add_argument('--to-file', action='store_true',
                             help='final output will be redirected to a file')
+    arg_parser.add_argument('--weighted', action='store_true',
+                            help='score patterns by the frequencies of the words they match')
+    arg_parser.add_argument('--grouping', choices=sorted(GROUPINGS), default='distance',
+                            help='how the words are grouped before finding candidate patterns')
+    arg_parser.add_argument('--candidates', choices=sorted(EXTRACTIONS), default='pairs',
+                            help='find the candidate patterns in every pair of words in a group, '
+                                 'or in the substrings, prefixes and suffixes the words share')
+    arg_parser.add_argument('--pair-budget', type=int,
+                            help='approximate mode: compare at most this many pairs of words '
+                                 'in every round')
+    arg_parser.add_argument('--time-limit', type=float,
+                            help='approximate mode: spend at most this many seconds '
+                                 'comparing pairs of words in every round')
+    arg_parser.add_argument('--seed', type=int, help='the seed for sampling pairs of words')
+    arg_parser.add_argument('--max-candidates', type=int,
+                            help='only keep this many of the most promising candidate patterns '
+                                 'in every round')
+    arg_parser.add_argument('--prune', action='store_true',
+                            help='drop the candidate patterns with a single element before matching '
+                                 '(faster, but may change the results)')
+    arg_parser.add_argument('--ratio-cache-size', type=int, default=RATIO_CACHE_SIZE,
+                            help='the number of Levenshtein ratios of pairs of words to keep '
+                                 'between the rounds of grouping (0 turns the cache off)')
+    arg_parser.add_argument('--deadline', type=float,
+                            help='stop after this many seconds and output the best patterns so far')
+    arg_parser.add_argument('--work-budget', type=int,
+                            help='stop after comparing this many pairs of words '
+                                 'and output the best patterns so far')
+    arg_parser.add_argument('--profile', metavar='PATH',
+                            help='write the timings and counters of every stage to a JSON file')
+    arg_parser.add_argument('--trace-memory', action='store_true',
+                            help='also record the peak memory of every stage in the profile')
+    arg_parser.add_argument('--checkpoint', metavar='PATH',
+                            help='save the progress of the run to this file every so often')
+    arg_parser.add_argument('--checkpoint-interval', type=float, default=60,
+                            help='the minimum number of seconds between checkpoints')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='continue the run saved in the --checkpoint file')
+    arg_parser.add_argument('--match-set-budget', type=float, metavar='MB',
+                            help='keep the sets of words the candidate patterns match on disk '
+                                 'once the sets take up more than this many megabytes of memory '
+                                 '(only the sets are counted, so the process takes up more than this)')
+    arg_parser.add_argument('--spill-dir', metavar='PATH',
+                            help='the directory for the sets kept on disk (see --match-set-budget)')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='print every pattern (with its score and the words it took out) '
+                                 'as soon as it is found')
+    arg_parser.add_argument('--cache-dir', metavar='PATH',
+                            help='look the result up in (and store it in) the cache in this directory')
+    arg_parser.add_argument('-v', '--verbose', action='store_true', help='verbose mode')
     args = arg_parser.parse_args()
     words_path = Path(args.words)
 
-    with words_path.open() as file:
-        the_words = re.findall("\w+'\w+|\w+", file.read())
+    if args.resume and not args.checkpoint:
+        arg_parser.error('--resume requires --checkpoint')
+
+    if args.candidates != 'pairs' and (args.pair_budget is not None or args.time_limit is not None):
+        arg_parser.error('the approximate mode only works with --candidates pairs')
+
+    if args.spill_dir and args.match_set_budget is None:
+        arg_parser.error('--spill-dir requires --match-set-budget')
+
+    if args.stream and args.to_file:
+        arg_parser.error('--stream prints the patterns as they are found, it can\'t be used with --to-file')
+
+    if args.stream and args.cache_dir:
+        arg_parser.error('only the results of whole runs are cached, --cache-dir can\'t be used with --stream')
+
+    # the words file may be either a plain text file or a compiled corpus
+    the_words = corpus.read_words(words_path, casefold=args.casefold)
+    if args.pair_budget is not None or args.time_limit is not None:
+        the_sampling = Sampling(args.pair_budget, args.time_limit, args.seed)
+    else:
+        the_sampling = None
+
+    if args.profile:
+        the_instrument = Instrumentation(trace_memory=args.trace_memory)
+    else:
+        the_instrument = NO_INSTRUMENTATION
+
+    if args.deadline is not None or args.work_budget is not None:
+        the_budget = Budget(args.deadline, args.work_budget)
+    else:
+        the_budget = None
 
-    if args.casefold:
-        the_words = (w.casefold() for w in the_words)
+    if args.resume:
+        the_checkpoint = Checkpoint.load(args.checkpoint, args.checkpoint_interval)
+    elif args.checkpoint:
+        the_checkpoint = Checkpoint(args.checkpoint, args.checkpoint_interval)
+    else:
+        the_checkpoint = None
+
+    run_args = dict(weighted=args.weighted, sampling=the_sampling, grouping=GROUPINGS[args.grouping],
+                    instrument=the_instrument, checkpoint=the_checkpoint, budget=the_budget,
+                    max_candidates=args.max_candidates, prune=args.prune,
+                    ratio_cache=RatioCache(args.ratio_cache_size),
+                    extraction=EXTRACTIONS[args.candidates], verbose=args.verbose)
+
+    if args.match_set_budget is not None:
+        run_args['memory_pool'] = MemoryPool(int(args.match_set_budget * 2 ** 20), args.spill_dir)
+
+    if args.cache_dir:
+        run_args['result_cache'] = ResultCache(args.cache_dir)
+
+    if args.stream:
+        result = []
+        for the_pattern, the_score, the_matches in stream_patterns(the_words, **run_args):
+            result.append((the_pattern, the_score))
+            print(pprint.pformat((the_pattern, the_score, sorted(the_matches))), flush=True)
+        completed = the_budget is None or not the_budget.ran_out
+    else:
+        result = run(the_words, **run_args)
+        completed = result.completed
+
+    if args.profile:
+        the_instrument.write_report(args.profile)
 
-    the_words = Counter(the_words)
-    result = run(the_words)
+    if the_sampling is not None:
+        print('sampled {} of {} pairs of words ({:.1%})'.format(the_sampling.sampled_pairs,
+                                                                the_sampling.total_pairs,
+                                                                the_sampling.coverage))
 
-    if args.to_file:
+    if not completed:
+        print('the run was cut short after comparing {} pairs of words, '
+              'these are the best patterns found so far'.format(the_budget.pairs))
+
+    if args.stream:
+        print('found {} patterns'.format(len(result)))
+    elif args.to_file:
         output_dir = Path('results')
         output_dir.mkdir(parents=True)
 
@@ -0,0 +1,285 @@
+"""
+A memory-mapped binary format for word lists.
+
+A word list is compiled once into a file with the deduplicated vocabulary,
+the frequency of every word (as counted by classify.py) and precomputed indexes:
+words bucketed by length, and postings of word ids for every character at every position.
+
+The file is opened with mmap, so opening it is instant and several worker processes
+which open the same file share its pages instead of each holding a copy.
+
+Usage:
+
+    python -m regexi.corpus data/arabic_roots.txt -o arabic_roots.rxc
+"""
+
+import mmap
+import re
+import struct
+import sys
+from argparse import ArgumentParser
+from array import array
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from regexi.wordstore import WordStore
+
+MAGIC = b'RGXC'
+VERSION = 1
+
+# the same tokenisation that classify.py uses
+TOKEN_PATTERN = r"\w+'\w+|\w+"
+
+# magic, version, byte order, then the number of words, code points,
+# the maximum word length, the number of posting keys and of postings
+_HEADER = struct.Struct('<4sHBx5Q')
+_BYTEORDERS = ('little', 'big')
+
+
+def _pad(length, alignment=8):
+    return -length % alignment
+
+
+def _posting_key(character, position, max_length):
+    # positions range from -max_length (counted from the end) to max_length - 1,
+    # so they are shifted to make every key a non-negative integer
+    return (position + max_length) << 32 | ord(character)
+
+
+def tokenize(lines, pattern=TOKEN_PATTERN, casefold=False):
+    regex = re.compile(pattern)
+    for line in lines:
+        for token in regex.findall(line):
+            if casefold:
+                token = token.casefold()
+            yield token
+
+
+def compile_corpus(words, path):
+    """
+    Write a binary corpus with the vocabulary of the given words.
+    The vocabulary keeps the order in which the words first occur.
+    :param words: an iterable of words (or a Counter of words and their frequencies)
+    :param path:
+    :return: the number of unique words written
+    """
+    if not isinstance(words, Counter):
+        words = Counter(words)
+
+    store = WordStore.from_words(words)
+    frequencies = array('Q', words.values())
+    max_length = max((store.word_length(n) for n in range(len(store))), default=0)
+
+    length_buckets = defaultdict(list)
+    postings = defaultdict(lambda: array('I'))
+
+    for word_id, word in enumerate(store):
+        length_buckets[len(word)].append(word_id)
+        for position, character in enumerate(word):
+            postings[_posting_key(character, position, max_length)].append(word_id)
+            postings[_posting_key(character, position - len(word), max_length)].append(word_id)
+
+    length_offsets = array('Q', [0])
+    length_ids = array('I')
+    for length in range(max_length + 1):
+        length_ids.extend(length_buckets[length])
+        length_offsets.append(len(length_ids))
+
+    posting_keys = array('Q', sorted(postings))
+    posting_offsets = array('Q', [0])
+    posting_ids = array('I')
+    for key in posting_keys:
+        posting_ids.extend(postings[key])
+        posting_offsets.append(len(posting_ids))
+
+    sections = (store.offsets, store.codepoints, frequencies,
+                length_offsets, length_ids,
+                posting_keys, posting_offsets, posting_ids)
+
+    header = _HEADER.pack(MAGIC, VERSION, _BYTEORDERS.index(sys.byteorder),
+                          len(store), len(store.codepoints), max_length,
+                          len(posting_keys), len(posting_ids))
+
+    with open(str(path), 'wb') as file:
+        file.write(header)
+        for section in sections:
+            data = section.tobytes()
+            file.write(data)
+            file.write(bytes(_pad(len(data))))
+
+    return len(store)
+
+
+def is_corpus(path):
+    try:
+        with open(str(path), 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class Corpus:
+    """
+    A compiled corpus opened with mmap.
+    All arrays are memoryviews into the mapped file, so nothing is copied.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+        with open(self.path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, byteorder,
+         num_words, num_codepoints, max_length,
+         num_keys, num_postings) = _HEADER.unpack_from(self._mmap)
+
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is not a compiled corpus'.format(self.path))
+        if version != VERSION:
+            self.close()
+            raise ValueError('unsupported corpus version {}'.format(version))
+        if _BYTEORDERS[byteorder] != sys.byteorder:
+            self.close()
+            raise ValueError('the corpus was compiled on a machine with a different byte order')
+
+        self.max_length = max_length
+        self._views = []
+        self._position = _HEADER.size
+
+        offsets = self._section('Q', num_words + 1)
+        codepoints = self._section('I', num_codepoints)
+        self.frequencies = self._section('Q', num_words)
+        self._length_offsets = self._section('Q', max_length + 2)
+        self._length_ids = self._section('I', num_words)
+        self._posting_keys = self._section('Q', num_keys)
+        self._posting_offsets = self._section('Q', num_keys + 1)
+        self._posting_ids = self._section('I', num_postings)
+
+        self.words = WordStore(codepoints, offsets)
+
+    def _section(self, typecode, length):
+        itemsize = struct.calcsize(typecode)
+        size = itemsize * length
+        view = memoryview(self._mmap)[self._position:self._position + size].cast(typecode)
+        self._views.append(view)
+        self._position += size + _pad(size)
+        return view
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        # worker processes reopen the file instead of receiving a copy of it
+        return Corpus, (self.path,)
+
+    def __repr__(self):
+        return 'Corpus({!r}, {} words)'.format(self.path, len(self))
+
+    def close(self):
+        for view in getattr(self, '_views', ()):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def counts(self):
+        """
+        :return: a Counter of words and their frequencies
+        """
+        return Counter(dict(zip(self.words, self.frequencies)))
+
+    def tokens(self):
+        """
+        Yield every word as many times as it occurred in the original word list.
+        """
+        for word, frequency in zip(self.words, self.frequencies):
+            for _ in range(frequency):
+                yield word
+
+    def word_ids_of_length(self, length):
+        if not 0 <= length <= self.max_length:
+            return self._length_ids[0:0]
+        start, end = self._length_offsets[length], self._length_offsets[length + 1]
+        return self._length_ids[start:end]
+
+    def postings(self, character, position):
+        """
+        Get the ids of words which have the given character at the given position.
+        :param character:
+        :param position: the index of the character (negative indexes count from the end)
+        :return:
+        """
+        if not -self.max_length <= position < self.max_length:
+            return self._posting_ids[0:0]
+
+        key = _posting_key(character, position, self.max_length)
+        keys = self._posting_keys
+
+        # binary search over the sorted keys
+        low, high = 0, len(keys)
+        while low < high:
+            middle = (low + high) // 2
+            if keys[middle] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(keys) or keys[low] != key:
+            return self._posting_ids[0:0]
+
+        start, end = self._posting_offsets[low], self._posting_offsets[low + 1]
+        return self._posting_ids[start:end]
+
+
+def open_corpus(path):
+    return Corpus(path)
+
+
+def read_words(path, pattern=TOKEN_PATTERN, casefold=False):
+    """
+    Read the words from either a compiled corpus or a plain text file.
+    :return: a Counter of words and their frequencies
+    """
+    if is_corpus(path):
+        with Corpus(path) as corpus:
+            counts = corpus.counts()
+        if casefold:
+            folded = Counter()
+            for word, frequency in counts.items():
+                folded[word.casefold()] += frequency
+            counts = folded
+        return counts
+
+    with open(str(path)) as file:
+        return Counter(tokenize(file, pattern, casefold=casefold))
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description='compile a word list into a binary corpus')
+    arg_parser.add_argument('words', help='the file with words')
+    arg_parser.add_argument('-o', '--output', help='the compiled corpus '
+                                                   '(by default, the words file with .rxc)')
+    arg_parser.add_argument('--casefold', action='store_true',
+                            help='ignore case in the input data')
+    arg_parser.add_argument('--tokens', default=TOKEN_PATTERN,
+                            help='the regex used to find words in the file')
+    args = arg_parser.parse_args()
+
+    words_path = Path(args.words)
+    output_path = Path(args.output) if args.output else words_path.with_suffix('.rxc')
+
+    with words_path.open() as words_file:
+        num_words = compile_corpus(tokenize(words_file, args.tokens, args.casefold),
+                                   output_path)
+
+    print('{} unique words written to {}'.format(num_words, output_path))
@@ -2,6 +2,8 @@ __author__ = 'anton'
 
 from argparse import ArgumentParser
 from collections import Counter, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce, partial
 from itertools import zip_longest, chain
 import json
@@ -11,6 +13,9 @@ from pprint import pprint, pformat
 import random
 import statistics
 
+from regexi.resultcache import ResultCache
+from regexi.wordstore import WordStore
+
 GroupRule = namedtuple('GroupRule', ('rule', 'group', 'segment'))
 
 class NoUniqueElementsError(Exception):
@@ -33,11 +38,60 @@ def ngramicise(word_list, n=2):
         yield ngram_word
 
 
-def find_letters(word_list, reverse=False):
+def prepare_words(word_list, ngrams=0, rtl=False):
+    """
+    Reverse the words and/or split them into n-grams.
+    Word stores are handled through views, so that the words are not copied.
+    :param word_list:
+    :param ngrams:
+    :param rtl:
+    :return:
+    """
+    if isinstance(word_list, WordStore):
+        if ngrams > 1:
+            return word_list.ngram_views(ngrams, reverse=rtl)
+        return word_list.views(reverse=rtl)
+
+    if rtl:
+        word_list = (tuple(reversed(word)) for word in word_list)
+
+    if ngrams > 1:
+        word_list = ngramicise(word_list, ngrams)
+
+    return word_list
+
+
+def split_weights(word_list):
+    """
+    Deduplicate a list of words, attaching to each unique word its frequency as a weight.
+    A mapping of words to their frequencies (e.g. a Counter) is also accepted.
+    :param word_list:
+    :return: the unique words and their weights (None if every word occurs only once)
+    """
+    if isinstance(word_list, WordStore):
+        return word_list, None
+
+    counted_words = Counter(word_list)
+    weights = list(counted_words.values())
+
+    if all(weight == 1 for weight in weights):
+        weights = None
+
+    return list(counted_words), weights
+
 
-    for segments in zip_longest(*word_list):
-        counted_segments = Counter(segments)
-        yield counted_segments
+def find_letters(word_list, reverse=False, weights=None):
+
+    if weights is None:
+        for segments in zip_longest(*word_list):
+            counted_segments = Counter(segments)
+            yield counted_segments
+    else:
+        for segments in zip_longest(*word_list):
+            counted_segments = Counter()
+            for segment, weight in zip(segments, weights):
+                counted_segments[segment] += weight
+            yield counted_segments
 
 def get_letter_differences(first_set: Counter, second_set: Counter,
                            min_count=2, threshold=0.15):
@@ -181,8 +235,10 @@ def has_unique_elements(segments):
     return total_length > 0
 
 
-def run_letters(first, second, verbose=False, filter_spurious=True):
-    segment_lists = list(find_letters(first)), list(find_letters(second))
+def run_letters(first, second, verbose=False, filter_spurious=True, weights=(None, None)):
+    first_weights, second_weights = weights
+    segment_lists = (list(find_letters(first, weights=first_weights)),
+                     list(find_letters(second, weights=second_weights)))
     unique_segment_lists = get_differences(*segment_lists)
 
     try:
@@ -216,7 +272,7 @@ def run_words(words, ngrams=0, rtl=False, verbose=False):
     """
     Returns the optimal generalisation,
     the list it came from and the segment in that list which gave it
-    :param words:
+    :param words: two lists of words (or Counters of words and their frequencies)
     :param ngrams:
     :param rtl:
     :param verbose:
@@ -225,16 +281,17 @@ def run_words(words, ngrams=0, rtl=False, verbose=False):
 
     first, second = words
 
-    if rtl:
-        first = (tuple(reversed(word)) for word in first)
-        second = (tuple(reversed(word)) for word in second)
+    # duplicate words are only counted once, with their frequency as a weight
+    first, first_weights = split_weights(first)
+    second, second_weights = split_weights(second)
 
-    if ngrams > 1:
-        first = ngramicise(first, ngrams)
-        second = ngramicise(second, ngrams)
+    first = prepare_words(first, ngrams, rtl)
+    second = prepare_words(second, ngrams, rtl)
 
+    weights = first_weights, second_weights
     best_segment_letters, best_set, best_segment, both_unique = run_letters(first, second,
-                                                                            verbose=verbose)
+                                                                            verbose=verbose,
+                                                                            weights=weights)
     best_segment_letters = tuple(best_segment_letters)
 
     if verbose:
@@ -293,9 +350,55 @@ def run_two(words, ngrams, with_ngrams=False, verbose=False):
         return rules_ltr, rules_rtl, both_unique
 
 
-def run_many(words, ngrams, with_ngrams=False, verbose=False):
+def run_group(n, group, words, control_group, ngrams, verbose=False):
+    """
+    Compare one group with the control group (or with all the other groups)
+    :return: the results of the left-to-right and the right-to-left runs
+        (each a tuple of the result and the words of the best set, or of two Nones)
+    """
+    if control_group:
+        other_group = Counter(control_group)
+    else:
+        # keep the frequencies of the words if the groups have them
+        other_group = Counter()
+        for g in words:
+            if g != group:
+                other_group.update(g)
+    word_groups = (Counter(group), other_group)
+
+    if verbose:
+        print('*' * 5)
+        print('run', n + 1)
+        pprint(word_groups)
+
+    try:
+        *result_ltr, _ = run_words(word_groups, ngrams=ngrams,
+                                                 verbose=verbose)
+        # we need this to pick the 'special sets' and the 'everything else' set
+        best_words_ltr = word_groups[result_ltr[1]]
+        ltr = (result_ltr, best_words_ltr)
+    except NoUniqueElementsError:
+        ltr = (None, None)
+
+    try:
+        *result_rtl, _ = run_words(word_groups, ngrams=ngrams, rtl=True,
+                                                 verbose=verbose)
+        best_words_rtl = word_groups[result_rtl[1]]
+        rtl = (result_rtl, best_words_rtl)
+    except NoUniqueElementsError:
+        rtl = (None, None)
+
+    return ltr, rtl
+
 
-    results_ltr, results_rtl = [], []
+def run_many(words, ngrams, with_ngrams=False, verbose=False, rng=None, threads=None):
+    """
+    :param rng: a random.Random to pick the control group with (a new one by default)
+    :param threads: run the groups in a pool of this many threads (one after the other by default);
+        the results are the same either way
+    """
+    if rng is None:
+        rng = random.Random()
 
     # choose whether to make a permanent control group to compare others to
     # a permanent control group is created by picking a random word from every group
@@ -307,40 +410,20 @@ def run_many(words, ngrams, with_ngrams=False, verbose=False):
     num_groups = len(words)
 
     if num_groups >= avg_group_len:
-        control_group = [random.choice(group) for group in words]
+        control_group = [rng.choice(list(group)) for group in words]
     else:
        control_group = None
 
+    run_one = partial(run_group, words=words, control_group=control_group, ngrams=ngrams,
+                      verbose=verbose)
+    if threads:
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(run_one, range(len(words)), words))
+    else:
+        results = [run_one(n, group) for n, group in enumerate(words)]
 
-    for n, group in enumerate(words):
-        if control_group:
-            other_group = control_group
-        else:
-            other_group = tuple(chain.from_iterable(g for g in words if g != group))
-        word_groups = (tuple(group), other_group)
-
-        if verbose:
-            print('*' * 5)
-            print('run', n + 1)
-            pprint(word_groups)
-
-        try:
-            *result_ltr, _ = run_words(word_groups, ngrams=ngrams,
-                                                     verbose=verbose)
-            # we need this to pick the 'special sets' and the 'everything else' set
-            best_words_ltr = word_groups[result_ltr[1]]
-            results_ltr.append((result_ltr, best_words_ltr))
-        except NoUniqueElementsError:
-            results_ltr.append((None, None))
-
-        try:
-            *result_rtl, _ = run_words(word_groups, ngrams=ngrams, rtl=True,
-                                                     verbose=verbose)
-            best_words_rtl = word_groups[result_rtl[1]]
-            results_rtl.append((result_rtl, best_words_rtl))
-        except NoUniqueElementsError:
-            results_rtl.append((None, None))
-
+    results_ltr = [ltr for ltr, _ in results]
+    results_rtl = [rtl for _, rtl in results]
     return results_ltr, results_rtl
 
 def pick_best_word_group(special_group, all_words):
@@ -411,21 +494,63 @@ def make_regex_rule(rule_ltr, rule_rtl, min_length, max_length):
 
     return regex_string
 
-def make_regex_rules(processed_ltr, procesed_rtl, words):
+def make_regex_rules(processed_ltr, procesed_rtl, make_rule):
     rules_ltr, else_ltr = processed_ltr
     rules_rtl, else_rtl = procesed_rtl
 
     assert else_ltr == else_rtl, ("'elsewhere' groups don't match: LTR is {} but RTL is {}"
                                   .format(else_ltr, else_rtl))
 
-    regex_rules = (make_regex_rule_p(rule_ltr, rule_rtl) for rule_ltr, rule_rtl
+    regex_rules = (make_rule(rule_ltr, rule_rtl) for rule_ltr, rule_rtl
                     in zip(rules_ltr, rules_rtl) if rule_ltr.rule or rule_rtl.rule)
     return regex_rules
 
 
 
 
-def run(words, ngrams=0, with_ngrams=False, verbose=False):
+def get_cache_key(result_cache, words, ngrams, with_ngrams, rng):
+    """
+    :return: the key of the result of a run in the result_cache, or None if it shouldn't be cached
+        (when the control group is picked by a new random generator)
+    """
+    # the state of the generator decides which words go in the control group (with more than 2 groups)
+    if len(words) <= 2:
+        random_state = None
+    elif rng is None:
+        return None
+    else:
+        random_state = rng.getstate()
+
+    # the groups as they were given (the order of the words changes which ones go in the control group)
+    data = [list(group.items()) if isinstance(group, Mapping) else list(group) for group in words]
+    params = {'ngrams': ngrams, 'with_ngrams': with_ngrams, 'random': random_state}
+    return result_cache.key('generalize', data, params)
+
+
+def run(words, ngrams=0, with_ngrams=False, verbose=False, rng=None, threads=None, result_cache=None):
+    """
+    Find the rules which set one (or more) of the groups of words apart from the others.
+    Nothing is shared between calls, so several runs can go on at the same time in different threads.
+    :param words: a list of two or more groups of words
+    :param ngrams:
+    :param with_ngrams:
+    :param verbose:
+    :param rng: a random.Random to pick the control group with (for more than 2 groups)
+    :param threads: the number of threads to run the groups in (for more than 2 groups)
+    :param result_cache: a resultcache.ResultCache to look the result up in (and store it in)
+    :return: the regex rule(s), whether both sets had unique elements, the best set and the 'else' group
+    """
+    cache_key = None
+    if result_cache is not None:
+        cache_key = get_cache_key(result_cache, words, ngrams, with_ngrams, rng)
+    if cache_key is not None:
+        stored = result_cache.get(cache_key)
+        if stored is not None:
+            regex_rules, both_unique, best_set, else_group = stored
+            # (JSON turns the tuple of rules into a list)
+            if isinstance(regex_rules, list):
+                regex_rules = tuple(regex_rules)
+            return regex_rules, both_unique, best_set, else_group
 
     # get the length ranges for words
     # this is needed to know if the rules identified above
@@ -433,9 +558,7 @@ def run(words, ngrams=0, with_ngrams=False, verbose=False):
     word_lengths = set(len(word) for word in chain.from_iterable(words))
     min_length, max_length = min(word_lengths), max(word_lengths)
 
-    global make_regex_rule_p # I know
-    make_regex_rule_p = partial(make_regex_rule,
-                                min_length=min_length, max_length=max_length)
+    make_rule = partial(make_regex_rule, min_length=min_length, max_length=max_length)
 
     # pre-initialise various variable to None
     # they will be redefined if applicable further in the code
@@ -444,26 +567,30 @@ def run(words, ngrams=0, with_ngrams=False, verbose=False):
 
     if len(words) == 2:
         ltr, rtl, both_unique = run_two(words, ngrams, with_ngrams, verbose)
-        regex_rules = make_regex_rule_p(ltr, rtl)
+        regex_rules = make_rule(ltr, rtl)
 
         # both best groups should be the same, so we'll just take the one from ltr
         best_set = ltr.group
 
     elif len(words) > 2:
 
-        results_ltr, results_rtl = run_many(words, ngrams, with_ngrams, verbose=verbose)
+        results_ltr, results_rtl = run_many(words, ngrams, with_ngrams, verbose=verbose, rng=rng,
+                                            threads=threads)
         rules_ltr = process_results_many(results_ltr, words)
         rules_rtl = process_results_many(results_rtl, words)
 
-        regex_rules = tuple(make_regex_rules(rules_ltr, rules_rtl, words))
+        regex_rules = tuple(make_regex_rules(rules_ltr, rules_rtl, make_rule))
         else_group = rules_ltr[1]
 
-
-        print("the 'else' group:", else_group)
+        if verbose:
+            print("the 'else' group:", else_group)
 
     else:
         raise ValueError('the data must have at least 2 lists of words')
 
+    if cache_key is not None:
+        result_cache.put(cache_key, [regex_rules, both_unique, best_set, else_group])
+
     return regex_rules, both_unique, best_set, else_group
 
 
@@ -477,11 +604,23 @@ if __name__ == '__main__':
                             help='run with ngrams of length n')
     arg_parser.add_argument('--with-ngrams', action='store_true',
                             help='run the script with up to n n-grams')
+    arg_parser.add_argument('--seed', type=int, help='the seed for picking the control group')
+    arg_parser.add_argument('--threads', type=int,
+                            help='compare the groups with the others in this many threads')
+    arg_parser.add_argument('--cache-dir', metavar='PATH',
+                            help='look the result up in (and store it in) the cache in this directory '
+                                 '(with more than 2 groups, only if --seed is given)')
     arg_parser.add_argument('-v', '--verbose', action='store_true', help='verbose mode')
     args = arg_parser.parse_args()
 
     with open(args.words) as words_file:
         words = json.load(words_file)
 
-    regex_rules = run(words, args.ngrams, args.with_ngrams, verbose=args.verbose)
+    # without a seed, the control group is picked by a new generator anyway (and the result isn't cached)
+    the_rng = random.Random(args.seed) if args.seed is not None else None
+    the_cache = ResultCache(args.cache_dir) if args.cache_dir else None
+    regex_rules = run(words, args.ngrams, args.with_ngrams, verbose=args.verbose,
+                      rng=the_rng, threads=args.threads, result_cache=the_cache)
+    if regex_rules[3] is not None:
+        print("the 'else' group:", regex_rules[3])
     print('regex:', pformat(regex_rules))
@@ -0,0 +1,112 @@
+"""
+Stage timers and counters for long runs of the scripts.
+
+An Instrumentation is passed to the functions that support it
+(e.g. classify.get_top_patterns), which report to it how long each stage took
+and how much work was done (pairs compared, regex evaluations, merges per round etc.).
+Hooks can be added to follow these events while the run is still going.
+"""
+
+import json
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    def __init__(self, trace_memory=False):
+        """
+        :param trace_memory: whether to record the peak memory of every stage with tracemalloc
+            (this slows everything down considerably)
+        """
+        self.timings = defaultdict(float)
+        self.stage_calls = Counter()
+        self.counters = Counter()
+        self.series = defaultdict(list)
+        self.peak_memory = {}
+        self.trace_memory = trace_memory
+        self.hooks = []
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add_hook(self, hook):
+        """
+        Add a function to be called with (event, name, value) on every event:
+        ('stage', name, seconds) when a stage ends, ('count', name, n) when a counter is increased,
+        and ('record', name, value) when a value is added to a series.
+        """
+        self.hooks.append(hook)
+
+    def _notify(self, event, name, value):
+        for hook in self.hooks:
+            hook(event, name, value)
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings[name] += seconds
+            self.stage_calls[name] += 1
+
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                self.peak_memory[name] = max(peak, self.peak_memory.get(name, 0))
+
+            self._notify('stage', name, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+        self._notify('count', name, n)
+
+    def record(self, name, value):
+        self.series[name].append(value)
+        self._notify('record', name, value)
+
+    def report(self):
+        report = {'stages': {name: {'seconds': seconds, 'calls': self.stage_calls[name]}
+                             for name, seconds in self.timings.items()},
+                  'counters': dict(self.counters),
+                  'series': dict(self.series)}
+
+        if self.trace_memory:
+            for name, peak in self.peak_memory.items():
+                report['stages'][name]['peak_memory'] = peak
+
+        return report
+
+    def write_report(self, path):
+        with open(str(path), 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Instrumentation which records nothing (used when none is given)
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def count(self, name, n=1):
+        pass
+
+    def record(self, name, value):
+        pass
+
+    def add_hook(self, hook):
+        raise TypeError('hooks cannot be added to NullInstrumentation')
+
+
+NO_INSTRUMENTATION = NullInstrumentation()
@@ -0,0 +1,291 @@
+"""
+Match sets (the sets of words the patterns match) which are kept on disk while they aren't needed,
+so that classify can collapse and score more candidate patterns than their match sets fit in memory.
+
+A MatchStore is a mapping of patterns to the sets of words they match. The sets it holds in memory
+count towards the budget of its MemoryPool (which the stores of a run share), and once they take up
+more than that, the ones used least recently are written to a temporary file (as the compressed
+differences between the sorted ids of their words) and read back when they are needed again.
+The budget is only for the match sets themselves: it isn't a limit on the memory of the process,
+as everything else (the words, the candidate patterns, the sizes and signatures of the sets, and so on)
+comes on top of it, and the set used last stays in memory even if it is bigger than the whole budget.
+The sizes of the sets and small signatures of their words always stay in memory, so the patterns
+can be sorted by the sizes of their sets, and most of the checks whether one set is a subset
+of another are done without reading anything back.
+
+    python -m regexi.classify data/finnish.json --match-set-budget 50
+"""
+
+import sys
+import tempfile
+import zlib
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from itertools import accumulate
+
+# every word id sets one of this many bits in the signature of a set
+SIGNATURE_BITS = 256
+
+
+def get_signature(word_ids):
+    return sum(1 << bit for bit in {word_id % SIGNATURE_BITS for word_id in word_ids})
+
+
+def encode(word_ids):
+    word_ids = sorted(word_ids)
+    deltas = array('L', (word_id - previous for previous, word_id in zip([0] + word_ids, word_ids)))
+    return zlib.compress(deltas.tobytes(), 1)
+
+
+def decode(data):
+    deltas = array('L')
+    deltas.frombytes(zlib.decompress(data))
+    return accumulate(deltas)
+
+
+class MemoryPool:
+    def __init__(self, budget, directory=None):
+        """
+        :param budget: the number of bytes the match sets of all the stores may take up in memory
+            (as sys.getsizeof counts them: only the sets themselves, not the words in them, which they share)
+        :param directory: the directory for the temporary files (the system's default one by default)
+        """
+        self.budget = budget
+        self.directory = directory
+
+        # the ids of the words, which are what is written to the files
+        self.words = []
+        self.word_ids = {}
+
+        # the size of every set in memory by (store, pattern), least recently used first
+        self._in_memory = OrderedDict()
+        self.used = 0
+        self.peak = 0
+
+        self.spills = 0
+        self.page_ins = 0
+
+    def set_words(self, words):
+        """
+        Number the words in the order they are iterated in (which is the order the words of a set
+        are added to it when it is read back, so a set made by adding the words in that order
+        iterates in the same order after being read back as before); only while no store has any sets
+        """
+        self.words = list(words)
+        self.word_ids = {word: n for n, word in enumerate(self.words)}
+
+    def get_ids(self, words):
+        word_ids = self.word_ids
+        ids = []
+        for word in words:
+            word_id = word_ids.get(word)
+            if word_id is None:
+                word_id = word_ids[word] = len(self.words)
+                self.words.append(word)
+            ids.append(word_id)
+        return ids
+
+    def keep(self, store, pattern, matches):
+        """
+        Count the set (which was just used, or has changed) towards the budget,
+        and spill the sets used least recently if it is over the budget
+        """
+        key = (store, pattern)
+        size = sys.getsizeof(matches)
+        self.used += size - self._in_memory.pop(key, 0)
+        self._in_memory[key] = size
+
+        # the set which was used last stays in memory, even if it is over the budget by itself
+        while self.used > self.budget and len(self._in_memory) > 1:
+            (other_store, other_pattern), other_size = self._in_memory.popitem(last=False)
+            self.used -= other_size
+            other_store.spill(other_pattern)
+            self.spills += 1
+
+        self.peak = max(self.peak, self.used)
+
+    def touch(self, store, pattern):
+        self._in_memory.move_to_end((store, pattern))
+
+    def forget(self, store, pattern):
+        self.used -= self._in_memory.pop((store, pattern), 0)
+
+
+class LazyMatches:
+    """
+    The set of words a pattern in a MatchStore matches, which is only read back if it has to be
+    to compare it to another one (as classify.collapse_subsets does)
+    """
+    __slots__ = ('store', 'pattern', 'size', 'signature')
+
+    def __init__(self, store, pattern):
+        self.store = store
+        self.pattern = pattern
+        self.size = store.size(pattern)
+        self.signature = store.signature(pattern)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __eq__(self, other):
+        if self.size != other.size or self.signature != other.signature:
+            return False
+        return self.load() == other.load()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def load(self):
+        return self.store[self.pattern]
+
+    def issubset(self, other):
+        if self.size > other.size or self.signature & ~other.signature:
+            return False
+        return self.load().issubset(other.load())
+
+
+class MatchStore(Mapping):
+    # the pool keeps track of the sets in memory by their stores, so stores are only equal to themselves
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __init__(self, pool, matched=()):
+        """
+        :param pool: the MemoryPool
+        :param matched: an iterable of (pattern, the set of words it matches) of different patterns
+            (the sets are kept as they are rather than copied)
+        """
+        self.pool = pool
+
+        # for every pattern (in the order they were added)
+        self._sizes = {}
+        self._signatures = {}
+
+        self._in_memory = {}
+        self._changed = set()
+        # the offset and the length of the latest copy of every set written to the file
+        self._on_disk = {}
+        self._file = None
+
+        for pattern, matches in matched:
+            self._insert(pattern, matches)
+
+    def __getitem__(self, pattern):
+        matches = self._in_memory.get(pattern)
+        if matches is not None:
+            self.pool.touch(self, pattern)
+            return matches
+
+        if pattern not in self._sizes:
+            raise KeyError(pattern)
+
+        matches = self._read(pattern)
+        self._in_memory[pattern] = matches
+        self.pool.page_ins += 1
+        self.pool.keep(self, pattern, matches)
+        return matches
+
+    def __contains__(self, pattern):
+        return pattern in self._sizes
+
+    def __iter__(self):
+        return iter(self._sizes)
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def size(self, pattern):
+        return self._sizes[pattern]
+
+    def signature(self, pattern):
+        return self._signatures[pattern]
+
+    def add(self, pattern, matches):
+        """
+        Add the words to the set of the pattern (like defaultdict(set)[pattern].update(matches))
+        """
+        if isinstance(matches, LazyMatches):
+            matches = matches.load()
+
+        if pattern not in self._sizes:
+            # the set is copied, since it may be the set of another pattern (or of another store)
+            self._insert(pattern, set(matches))
+            return
+
+        current = self[pattern]
+        current.update(matches)
+        self._sizes[pattern] = len(current)
+        self._signatures[pattern] |= get_signature(self.pool.get_ids(matches))
+        self._changed.add(pattern)
+        self.pool.keep(self, pattern, current)
+
+    def _insert(self, pattern, matches):
+        self._in_memory[pattern] = matches
+        self._sizes[pattern] = len(matches)
+        self._signatures[pattern] = get_signature(self.pool.get_ids(matches))
+        self._changed.add(pattern)
+        self.pool.keep(self, pattern, matches)
+
+    def all_in_memory(self):
+        """
+        :return: whether none of the sets has to be read back (so none will be, until one is added)
+        """
+        return len(self._in_memory) == len(self._sizes)
+
+    def lazy_items(self):
+        """
+        :return: a list of (pattern, LazyMatches) tuples
+        """
+        return [(pattern, LazyMatches(self, pattern)) for pattern in self._sizes]
+
+    def empty(self):
+        """
+        :return: a new store in the same pool
+        """
+        return MatchStore(self.pool)
+
+    def spill(self, pattern):
+        """
+        Take the set out of memory (writing it to the file if it isn't there already);
+        only called by the pool
+        """
+        matches = self._in_memory.pop(pattern)
+        if pattern in self._changed:
+            self._write(pattern, matches)
+            self._changed.discard(pattern)
+
+    def _write(self, pattern, matches):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='regexi-matches-', dir=self.pool.directory)
+
+        data = encode(self.pool.get_ids(matches))
+        self._file.seek(0, 2)
+        self._on_disk[pattern] = self._file.tell(), len(data)
+        self._file.write(data)
+
+    def _read(self, pattern):
+        offset, length = self._on_disk[pattern]
+        self._file.seek(offset)
+        words = self.pool.words
+        return {words[word_id] for word_id in decode(self._file.read(length))}
+
+    def close(self):
+        """
+        Take all the sets out of memory and delete the file (the store is empty afterwards)
+        """
+        for pattern in self._in_memory:
+            self.pool.forget(self, pattern)
+
+        self._sizes.clear()
+        self._signatures.clear()
+        self._in_memory.clear()
+        self._changed.clear()
+        self._on_disk.clear()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
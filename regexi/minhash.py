@@ -0,0 +1,149 @@
+"""
+MinHash signatures and locality-sensitive hashing for words.
+
+Words are represented by the sets of their character n-grams.
+Words whose n-gram sets are similar are likely to share at least one LSH bucket,
+so the candidate neighbours of a word can be looked up without scanning every group.
+
+Run this module to compare the MinHash grouping with classify.group_by_distance:
+
+    python -m regexi.minhash data/arabic_roots.txt
+"""
+
+import itertools
+import random
+import statistics
+import time
+import zlib
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+
+def get_ngrams(word, n=2):
+    # mark the boundaries so that short words and anchored n-grams count too
+    word = '^{}$'.format(word)
+    if len(word) <= n:
+        return {word}
+    return {word[i:i + n] for i in range(len(word) - n + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm=32, ngram=2, seed=1):
+        rng = random.Random(seed)
+        self.ngram = ngram
+        # XOR-ing the hashes with random masks is a cheap stand-in
+        # for applying random permutations to them
+        self.masks = [rng.getrandbits(32) for _ in range(num_perm)]
+
+    def signature(self, word):
+        # crc32 rather than hash() so that the signatures are the same in every process
+        hashes = [zlib.crc32(ngram.encode('utf-8')) for ngram in get_ngrams(word, self.ngram)]
+        return tuple(min(h ^ mask for h in hashes) for mask in self.masks)
+
+
+class LSHIndex:
+    """
+    Buckets of keys (e.g. group ids) by bands of MinHash signatures.
+    With many short bands, even fairly dissimilar words end up sharing a bucket,
+    which suits the low Levenshtein threshold used for grouping.
+    """
+
+    def __init__(self, num_perm=32, bands=16, ngram=2, seed=1):
+        if num_perm % bands:
+            raise ValueError('the number of permutations must be divisible by the number of bands')
+
+        self.hasher = MinHasher(num_perm, ngram, seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = defaultdict(set)
+
+    def band_keys(self, word):
+        signature = self.hasher.signature(word)
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, word, key):
+        for band_key in self.band_keys(word):
+            self.buckets[band_key].add(key)
+
+    def query(self, word):
+        """
+        Get the keys which share at least one bucket with the word,
+        the keys sharing the most buckets first.
+        """
+        collisions = Counter()
+        for band_key in self.band_keys(word):
+            collisions.update(self.buckets.get(band_key, ()))
+        return [key for key, _ in collisions.most_common()]
+
+
+def get_group_labels(groups):
+    labels = {}
+    for n, group in enumerate(groups):
+        for word in group:
+            labels[word] = n
+    return labels
+
+
+def rand_index(groups1, groups2):
+    """
+    The share of word pairs on which two groupings agree
+    (i.e. both put the pair in the same group, or both put it in different groups)
+    """
+    labels1, labels2 = get_group_labels(groups1), get_group_labels(groups2)
+    words = sorted(set(labels1).intersection(labels2))
+
+    agreements, total = 0, 0
+    for word1, word2 in itertools.combinations(words, 2):
+        same1 = labels1[word1] == labels1[word2]
+        same2 = labels2[word1] == labels2[word2]
+        agreements += same1 == same2
+        total += 1
+
+    try:
+        return agreements / total
+    except ZeroDivisionError:
+        return 1.0
+
+
+def mean_group_ratio(groups, ratio):
+    """
+    The mean Levenshtein ratio of the pairs of words within the same group
+    """
+    ratios = [ratio(word1, word2) for group in groups
+              for word1, word2 in itertools.combinations(group, 2)]
+    try:
+        return statistics.mean(ratios)
+    except statistics.StatisticsError:
+        return 0.0
+
+
+def compare_groupings(words):
+    # imported here because classify depends on this module
+    from regexi import classify
+
+    results = {}
+    for name, grouping in classify.GROUPINGS.items():
+        start = time.perf_counter()
+        groups = grouping(list(words))
+        seconds = time.perf_counter() - start
+        results[name] = groups
+
+        print('{}: {} groups in {:.3f}s, mean ratio within groups {:.3f}'.format(
+            name, len(groups), seconds, mean_group_ratio(groups, classify.lev.ratio)))
+
+    print('agreement between the groupings (Rand index): {:.3f}'.format(
+        rand_index(results['distance'], results['minhash'])))
+
+    return results
+
+
+if __name__ == '__main__':
+    from regexi import corpus
+
+    arg_parser = ArgumentParser(description='compare the MinHash grouping with the Levenshtein grouping')
+    arg_parser.add_argument('words', help='the file with words (or a compiled corpus)')
+    arg_parser.add_argument('--casefold', action='store_true',
+                            help='ignore case in the input data')
+    args = arg_parser.parse_args()
+
+    compare_groupings(corpus.read_words(args.words, casefold=args.casefold))
@@ -0,0 +1,263 @@
+"""
+Online classification: adding words to an existing classify.py result without starting over.
+
+An OnlineClassifier keeps the state of the first (and most expensive) round of classify.get_top_patterns:
+the groups of words, the candidate patterns made from the pairs of words in every group,
+and the words every candidate matches. New words are put into the existing groups (or new ones),
+and only the pairs they form are turned into new candidates. The existing candidates are only matched
+against the new words, and only the patterns whose matches (or overlaps) changed are scored again.
+
+The state can be saved to a (gzipped JSON) file and loaded again in a later run:
+
+    python -m regexi.online state.json.gz data/arabic_roots.txt
+"""
+
+import gzip
+import json
+import pprint
+from argparse import ArgumentParser
+from collections import Counter
+from collections.abc import Mapping
+from pathlib import Path
+
+from regexi import classify, corpus, patternize
+from regexi.classify import Pattern
+
+STATE_VERSION = 1
+
+
+def get_new_pairs(group, new_words):
+    """
+    Get the pairs of words in the group in which at least one of the words is new,
+    in the same order as itertools.combinations would give them.
+    """
+    for j, word2 in enumerate(group):
+        if word2 in new_words:
+            for word1 in group[:j]:
+                yield word1, word2
+        else:
+            for word1 in group[:j]:
+                if word1 in new_words:
+                    yield word1, word2
+
+
+def get_affected_patterns(old_patterns, new_patterns, changed_words=()):
+    """
+    Find the patterns whose scores may have changed:
+    the patterns which are new or match different words,
+    and the patterns which overlap with any of those (before or after the change).
+    :param old_patterns: a dict of patterns and their matches
+    :param new_patterns: a dict of patterns and their matches
+    :param changed_words: any other words whose weight has changed
+    :return:
+    """
+    changed = {pattern for pattern, matches in new_patterns.items()
+               if old_patterns.get(pattern) != matches}
+    changed.update(pattern for pattern in old_patterns if pattern not in new_patterns)
+
+    changed_words = set(changed_words)
+    for pattern in changed:
+        changed_words.update(old_patterns.get(pattern, ()))
+        changed_words.update(new_patterns.get(pattern, ()))
+
+    return {pattern for pattern, matches in new_patterns.items()
+            if pattern in changed or not matches.isdisjoint(changed_words)}
+
+
+class OnlineClassifier:
+    def __init__(self, grouping=classify.group_by_distance, weighted=False):
+        """
+        :param grouping: the function which groups the first batch of words
+            (and the remaining words in later rounds)
+        :param weighted: whether the frequencies of the words should count towards the scores
+        """
+        self.grouping = grouping
+        self.weighted = weighted
+
+        self.words = Counter()
+        self.groups = []
+        self.candidates = Counter()
+        # every candidate and the words it matches (possibly none yet)
+        self.matches = {}
+
+        self._patterns = {}
+        self._scores = {}
+        self._stale = False
+        self._changed_words = set()
+
+    @property
+    def weights(self):
+        return self.words if self.weighted else None
+
+    def _find_group(self, word):
+        for group in self.groups:
+            if classify.is_close(word, group):
+                return group
+        return None
+
+    def _assign(self, new_words):
+        if not self.groups:
+            self.groups = self.grouping(list(new_words))
+            return
+
+        for word in new_words:
+            group = self._find_group(word)
+            if group is None:
+                self.groups.append([word])
+            else:
+                group.append(word)
+
+        classify.merge_singletons(self.groups)
+
+    def add(self, words):
+        """
+        Add words (or more occurrences of words which are already there)
+        :param words: a list of words or a Counter of words and their frequencies
+        :return: the new words
+        """
+        if not isinstance(words, Mapping):
+            words = Counter(words)
+
+        new_words = [word for word in words if word not in self.words]
+        if self.weighted:
+            self._changed_words.update(word for word in words if word in self.words)
+            self._stale = True
+
+        self.words.update(words)
+
+        if not new_words:
+            return new_words
+
+        self._assign(new_words)
+
+        new_word_set = set(new_words)
+        new_candidates = Counter()
+        for group in self.groups:
+            for word1, word2 in get_new_pairs(group, new_word_set):
+                pattern, _ = patternize.find_pattern((word1, word2))
+                if pattern:
+                    new_candidates[Pattern(pattern)] += 1
+
+        # the existing candidates only need to be matched against the new words,
+        # and only the new candidates against all the words
+        if self.matches:
+            for pattern, matches in classify.match_all(self.matches, new_words).items():
+                self.matches[pattern].update(matches)
+
+        fresh_candidates = [pattern for pattern in new_candidates if pattern not in self.matches]
+        self.matches.update(classify.match_all(fresh_candidates, self.words))
+
+        self.candidates.update(new_candidates)
+        self._stale = True
+
+        return new_words
+
+    def _update_scores(self):
+        if not self._stale:
+            return
+
+        candidates = {pattern: set(matches) for pattern, matches in self.matches.items() if matches}
+        collapsed = classify.collapse_subsets(candidates)
+        patterns = classify.match_all(collapsed, self.words)
+
+        affected = get_affected_patterns(self._patterns, patterns, self._changed_words)
+        scores = {pattern: score for pattern, score in self._scores.items()
+                  if pattern in patterns and pattern not in affected}
+        scores.update(classify.get_pattern_scores(patterns, self.weights, only=affected))
+
+        self._patterns = patterns
+        self._scores = scores
+        self._changed_words = set()
+        self._stale = False
+
+    def top_patterns(self):
+        """
+        :return: a list of (pattern, score) tuples, like classify.get_top_patterns
+        """
+        self._update_scores()
+
+        scores = ((pattern, self._scores[pattern]) for pattern in self._patterns)
+        try:
+            top_pattern, score = max(scores, key=lambda item: item[1])
+        except ValueError:
+            return []
+
+        if score <= 0:
+            return []
+
+        # the rounds after the first only deal with the words left over, so they are run as usual
+        other_words = classify.remove_group(self._patterns[top_pattern], self._patterns)
+        return classify.get_top_patterns(other_words, [(top_pattern, score)],
+                                         weights=self.weights, grouping=self.grouping)
+
+    def result(self):
+        """
+        :return: the patterns and the words they match, sorted by score (like classify.run)
+        """
+        patterns = dict(self.top_patterns())
+        patterns_and_matches = ((pattern, list(classify.get_regex_matches(pattern, self.words)))
+                                for pattern in patterns)
+        return sorted(patterns_and_matches, key=lambda item: patterns[item[0]], reverse=True)
+
+    def save(self, path):
+        words = list(self.words)
+        word_ids = {word: n for n, word in enumerate(words)}
+
+        state = {'version': STATE_VERSION,
+                 'weighted': self.weighted,
+                 'words': [[word, self.words[word]] for word in words],
+                 'groups': [[word_ids[word] for word in group] for group in self.groups],
+                 'candidates': [[pattern.to_json(), count,
+                                 sorted(word_ids[word] for word in self.matches[pattern])]
+                                for pattern, count in self.candidates.items()]}
+
+        with gzip.open(str(path), 'wt', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, grouping=classify.group_by_distance):
+        with gzip.open(str(path), 'rt', encoding='utf-8') as file:
+            state = json.load(file)
+
+        if state['version'] != STATE_VERSION:
+            raise ValueError('unsupported state version {}'.format(state['version']))
+
+        classifier = cls(grouping=grouping, weighted=state['weighted'])
+        words = [word for word, _ in state['words']]
+
+        classifier.words = Counter(dict(state['words']))
+        classifier.groups = [[words[n] for n in group] for group in state['groups']]
+
+        for elements, count, word_ids in state['candidates']:
+            pattern = Pattern.from_json(elements)
+            classifier.candidates[pattern] = count
+            classifier.matches[pattern] = {words[n] for n in word_ids}
+
+        classifier._stale = True
+        return classifier
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description='add words to a saved classification')
+    arg_parser.add_argument('state', help='the file with the saved state (created if missing)')
+    arg_parser.add_argument('words', help='the file with the new words (or a compiled corpus)')
+    arg_parser.add_argument('--casefold', action='store_true',
+                            help='ignore case in the input data')
+    arg_parser.add_argument('--weighted', action='store_true',
+                            help='score patterns by the frequencies of the words they match '
+                                 '(only when creating a new state)')
+    args = arg_parser.parse_args()
+
+    state_path = Path(args.state)
+    if state_path.exists():
+        classifier = OnlineClassifier.load(state_path)
+    else:
+        classifier = OnlineClassifier(weighted=args.weighted)
+
+    added = classifier.add(corpus.read_words(args.words, casefold=args.casefold))
+    classifier.save(state_path)
+    print('{} new words ({} in total)'.format(len(added), len(classifier.words)))
+
+    result = classifier.result()
+    print('found {} patterns'.format(len(result)))
+    pprint.pprint(result)
@@ -2,13 +2,15 @@
 (c) 2015-2016 Anton Melnikov
 """
 
-import re
 import warnings
 from argparse import ArgumentParser
 from collections import defaultdict
 from functools import partial
 from pprint import pprint
 
+from regexi import corpus
+from regexi.resultcache import ResultCache
+
 try:
     from greenery import lego
 except ImportError:
@@ -334,7 +336,138 @@ def find_common_pattern(pattern1, pattern2, verbose=False):
     return common_pattern
 
 
-def find_pattern(words, allow_unmatched=False, verbose=False):
+def get_common_pattern(one, two, verbose=False):
+    """
+    Align two words (or patterns) by matching their closest common letters
+    :return: the common pattern, or None if there is none
+    """
+    try:
+        pattern1, pattern2 = get_pattern_pair(one, two, verbose=verbose)
+        return find_common_pattern(pattern1, pattern2, verbose=verbose)
+    except TypeError:
+        return None
+
+
+def get_characters(element):
+    if element is None:
+        return ()
+    if isinstance(element, AmbiguousElement):
+        return element.value
+    return (element,)
+
+
+def get_common_element(element1, element2):
+    """
+    :return: the character (or the ambiguous element) which both elements can be, or None
+    """
+    characters = set(get_characters(element1)).intersection(get_characters(element2))
+    if not characters:
+        return None
+    if len(characters) == 1:
+        return characters.pop()
+    return AmbiguousElement(*sorted(characters))
+
+
+def get_lcs_rows(sequence1, sequence2):
+    """
+    Compute the table of the lengths of the longest common subsequences of the prefixes of the sequences
+    with bit vectors (Hyyrö's bit-parallel algorithm), using Python ints as the vectors.
+    In row j, the length of the LCS of sequence1[:i] and sequence2[:j] is the number of zeros
+    in the lowest i bits.
+    :return: a list of the rows, one for every prefix of sequence2 (including the empty one)
+    """
+    masks = defaultdict(int)
+    for i, element in enumerate(sequence1):
+        for character in get_characters(element):
+            masks[character] |= 1 << i
+
+    all_ones = (1 << len(sequence1)) - 1
+    row = all_ones
+    rows = [row]
+
+    for element in sequence2:
+        match = 0
+        for character in get_characters(element):
+            match |= masks.get(character, 0)
+        matched = row & match
+        row = ((row + matched) | (row - matched)) & all_ones
+        rows.append(row)
+
+    return rows
+
+
+def find_lcs_pattern(one, two, verbose=False):
+    """
+    Align two words (or patterns) by their longest common subsequence,
+    and make the pattern of the common elements with gaps (None) wherever either of them has anything else
+    :return: the common pattern, or None if there is none
+    """
+    sequence1, sequence2 = list(one), list(two)
+    rows = get_lcs_rows(sequence1, sequence2)
+
+    def lcs_length(i, j):
+        return i - bin(rows[j] & ((1 << i) - 1)).count('1')
+
+    # trace the table back from the end to find the matched elements
+    matched = []
+    i, j = len(sequence1), len(sequence2)
+    while i > 0 and j > 0:
+        length = lcs_length(i, j)
+        if not length:
+            break
+
+        common_element = get_common_element(sequence1[i - 1], sequence2[j - 1])
+        if common_element is not None and lcs_length(i - 1, j - 1) == length - 1:
+            matched.append((i - 1, j - 1, common_element))
+            i -= 1
+            j -= 1
+        elif lcs_length(i - 1, j) == length:
+            i -= 1
+        else:
+            j -= 1
+
+    if not matched:
+        return None
+
+    common_pattern = []
+    previous1, previous2 = -1, -1
+    for index1, index2, element in reversed(matched):
+        if index1 > previous1 + 1 or index2 > previous2 + 1:
+            common_pattern.append(None)
+        common_pattern.append(element)
+        previous1, previous2 = index1, index2
+
+    if previous1 < len(sequence1) - 1 or previous2 < len(sequence2) - 1:
+        common_pattern.append(None)
+
+    if verbose:
+        print('combined pattern', common_pattern)
+
+    return common_pattern
+
+
+# the ways of aligning two words (or patterns)
+ENGINES = {'heuristic': get_common_pattern,
+           'lcs': find_lcs_pattern}
+
+
+def find_pattern(words, allow_unmatched=False, verbose=False, engine='heuristic'):
+    """
+    Find the pattern common to all the words, by aligning the first two,
+    and then the pattern of those with every following word
+    :param words:
+    :param allow_unmatched: skip the words which have nothing in common with the pattern so far
+        (rather than give up)
+    :param verbose:
+    :param engine: how two words are aligned: 'heuristic' matches their closest common letters,
+        'lcs' finds their longest common subsequence
+    :return: the pattern (or None) and the words which were skipped (or the words left)
+    """
+    try:
+        align = ENGINES[engine]
+    except KeyError:
+        raise ValueError('unknown engine: {}'.format(engine))
+
     unmatched_words = []
     combined_pattern = None
     rest = words
@@ -346,11 +479,7 @@ def find_pattern(words, allow_unmatched=False, verbose=False):
             print('remaining words:')
             pprint(rest)
 
-        try:
-            pattern1, pattern2 = get_pattern_pair(one, two, verbose=verbose)
-            new_pattern = find_common_pattern(pattern1, pattern2, verbose=verbose)
-        except TypeError:
-            new_pattern = None
+        new_pattern = align(one, two, verbose=verbose)
 
         if new_pattern:
             # only assign the pattern if one could be found
@@ -412,9 +541,32 @@ def make_regex(pattern):
     return expression
 
 
-def run_find_all(words, regexify=True, verbose=False):
+def run_find_all(words, regexify=True, verbose=False, engine='heuristic', result_cache=None):
+    """
+    :param words:
+    :param regexify: turn the pattern into a regex (with lego)
+    :param verbose:
+    :param engine: the engine of find_pattern
+    :param result_cache: a resultcache.ResultCache to look the result up in (and store it in)
+    :return: the regex (or the pattern) of the words, or '' if they have none
+    """
+    # skip duplicate words, keeping the order in which they were given
+    words = list(dict.fromkeys(words))
+
+    if result_cache is not None:
+        # the words are aligned in the order they were given, so it is kept
+        params = {'regexify': bool(lego and regexify), 'engine': engine}
+        cache_key = result_cache.key('patternize', words, params)
+        stored = result_cache.get(cache_key)
+        if stored is not None:
+            return stored
+
+        result = run_find_all(words, regexify, verbose, engine)
+        result_cache.put(cache_key, result)
+        return result
+
     try:
-        pattern, unmatched_words = find_pattern(words, verbose=verbose)
+        pattern, unmatched_words = find_pattern(words, verbose=verbose, engine=engine)
     except TypeError:
         pattern = None
 
@@ -432,16 +584,17 @@ def run_find_all(words, regexify=True, verbose=False):
     return str(regex)
 
 
-def run(file, mode, verbose=False):
-    with open(file) as word_list_file:
-        words = re.findall('\w+', word_list_file.read(), re.MULTILINE)
+def run(file, mode, verbose=False, engine='heuristic', result_cache=None):
+    # (the words of a plain text file are found the same way as those of a compiled corpus)
+    words = corpus.read_words(file, casefold=True)
 
     if not words:
         raise ValueError('the word list is empty')
 
-    words = sorted(word.casefold() for word in words)
+    # duplicate words add nothing to the pattern, so each word is only folded in once
+    words = sorted(words)
 
-    result = run_find_all(words, verbose=verbose)
+    result = run_find_all(words, verbose=verbose, engine=engine, result_cache=result_cache)
     print(result)
 
     return result
@@ -454,5 +607,11 @@ if __name__ == '__main__':
                             default=70)
     arg_parser.add_argument('--mode', choices=('all', 'vs'), default='all')
     arg_parser.add_argument('--combine-patterns', action='store_true')
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='heuristic',
+                            help='align the words by their closest common letters '
+                                 'or by their longest common subsequence')
+    arg_parser.add_argument('--cache-dir', metavar='PATH',
+                            help='look the result up in (and store it in) the cache in this directory')
     args = arg_parser.parse_args()
-    run(args.file, args.tolerance)
+    the_cache = ResultCache(args.cache_dir) if args.cache_dir else None
+    run(args.file, args.tolerance, engine=args.engine, result_cache=the_cache)
@@ -0,0 +1,123 @@
+"""
+A cache of the results of whole runs of classify, generalize and patternize, kept in a directory.
+
+Every result is stored under the SHA-256 hash of the analyzer, its input (normalized, so that
+the same words given in another form are still found), the parameters which change the result,
+and the version of regexi (so that a new version doesn't return the results of an old one).
+Every result is a gzipped JSON file, and once the files take up more than the size of the cache,
+the ones used least recently are deleted.
+
+    python -m regexi.classify data/arabic_roots.txt --cache-dir ~/.cache/regexi
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from pathlib import Path
+
+from regexi import __version__
+
+# the maximum number of bytes the results take up on disk by default
+CACHE_SIZE = 256 * 2 ** 20
+
+
+class ResultCache:
+    def __init__(self, directory, max_size=CACHE_SIZE):
+        """
+        :param directory: the directory of the cache (created if it doesn't exist)
+        :param max_size: the maximum number of bytes the results may take up
+        """
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, analyzer, data, params):
+        """
+        :param analyzer: the name of the analyzer
+        :param data: the normalized input (anything JSON can serialize)
+        :param params: a dict of the parameters which change the result
+        :return: the key of the result
+        """
+        content = json.dumps({'analyzer': analyzer, 'version': __version__, 'params': params,
+                              'data': data}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.directory / (key + '.json.gz')
+
+    def get(self, key):
+        """
+        :return: the result stored under the key, or None if there is none
+        """
+        path = self._path(key)
+        try:
+            with gzip.open(str(path), 'rt', encoding='utf-8') as file:
+                result = json.load(file)
+        except FileNotFoundError:
+            # (another process may have just deleted it)
+            self.misses += 1
+            return None
+        except (OSError, EOFError, ValueError, zlib.error):
+            # a file which isn't gzip (gzip.BadGzipFile is an OSError), is cut short or isn't JSON
+            # would be a miss every time, so it is deleted to make way for a good one
+            self.misses += 1
+            self._remove(path)
+            return None
+
+        # the results used least recently are the first to go
+        try:
+            os.utime(str(path))
+        except FileNotFoundError:
+            pass
+
+        self.hits += 1
+        return result
+
+    def _remove(self, path):
+        try:
+            os.remove(str(path))
+        except FileNotFoundError:
+            pass
+
+    def put(self, key, result):
+        """
+        Store the result (anything JSON can serialize) under the key,
+        and make room for it by deleting the results used least recently if needed
+        """
+        path = self._path(key)
+        temp_path = path.with_name('.{}.{}.tmp'.format(path.name, os.getpid()))
+        with gzip.open(str(temp_path), 'wt', encoding='utf-8', compresslevel=1) as file:
+            json.dump(result, file, ensure_ascii=False)
+        os.replace(str(temp_path), str(path))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(str(self.directory)):
+            if entry.name.endswith('.json.gz') and not entry.name.startswith('.'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            self._remove(path)
+            size -= entry_size
+            self.evictions += 1
+
+    def clear(self):
+        for entry in os.scandir(str(self.directory)):
+            if entry.name.endswith('.json.gz'):
+                os.remove(entry.path)
+
@@ -0,0 +1,392 @@
+"""
+Sharded execution of classify: the pairwise pattern extraction and the matching of the candidate patterns
+are split into jobs, which are done by worker processes (on this or other hosts),
+and their results are merged before the patterns are collapsed.
+
+The jobs go through a work queue in a directory (which can be shared between hosts):
+a job is a file in pending/, which a worker claims by moving it to claimed/ under a name of its own
+(renaming is atomic, so only one worker gets it), and the result is written to results/. Words are referred
+to by their ids in a word list which is written to the directory once for every round. The names of
+the jobs and the word lists include an id of the run, so that nothing is mixed up with an earlier run.
+
+    python -m regexi.shard run data/arabic_roots.txt --queue /tmp/queue --workers 4
+
+and, to help with the same run from other hosts,
+
+    python -m regexi.shard worker /tmp/queue
+"""
+
+import gzip
+import itertools
+import json
+import multiprocessing
+import os
+import pprint
+import time
+import uuid
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+
+from regexi import classify, corpus
+from regexi.classify import Pattern
+
+
+def write_file(path, data):
+    """
+    Write the data to a gzipped JSON file, which only appears under its name once it is complete
+    """
+    path = Path(path)
+    temp_path = path.with_name('.{}.{}.tmp'.format(path.name, os.getpid()))
+    with gzip.open(str(temp_path), 'wt', encoding='utf-8', compresslevel=1) as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(str(temp_path), str(path))
+
+
+def read_file(path):
+    with gzip.open(str(path), 'rt', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def get_job_name(claim):
+    """
+    :return: the name of the job of a claim (see WorkQueue.claim)
+    """
+    return claim.rsplit('.', 1)[0]
+
+
+class WorkQueue:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.pending = self.path / 'pending'
+        self.claimed = self.path / 'claimed'
+        self.results = self.path / 'results'
+        self.data = self.path / 'data'
+
+        for directory in (self.pending, self.claimed, self.results, self.data):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, name, job):
+        write_file(self.pending / name, job)
+
+    def claim(self):
+        """
+        :return: the name of the claim (the name of the job with a token which is only this claim's)
+            and the contents of a pending job (which no other worker can claim now), or None if there are none
+        """
+        for name in sorted(os.listdir(str(self.pending))):
+            if name.startswith('.'):
+                continue
+            # (if the job is put back in the queue and claimed again, the two claims have different names)
+            claim = '{}.{}-{}'.format(name, os.getpid(), uuid.uuid4().hex)
+            try:
+                # renaming keeps the time the job was written, so the time it is claimed is set first
+                # (otherwise a job which waited longer than the stale time would be requeued at once)
+                os.utime(str(self.pending / name))
+                os.rename(str(self.pending / name), str(self.claimed / claim))
+            except FileNotFoundError:
+                # another worker was faster
+                continue
+            return claim, read_file(self.claimed / claim)
+        return None
+
+    def complete(self, claim, result):
+        name = get_job_name(claim)
+        write_file(self.results / name, result)
+        try:
+            os.remove(str(self.claimed / claim))
+        except FileNotFoundError:
+            # the job was put back in the queue while it was being done (see requeue_stale),
+            # so unless another worker has claimed it again (which is that worker's claim to remove),
+            # it doesn't need to be done again
+            try:
+                os.remove(str(self.pending / name))
+            except FileNotFoundError:
+                pass
+
+    def requeue_stale(self, max_age):
+        """
+        Put the jobs which were claimed more than max_age seconds ago back in the queue
+        (their workers have probably died)
+        """
+        now = time.time()
+        for claim in os.listdir(str(self.claimed)):
+            try:
+                if now - os.path.getmtime(str(self.claimed / claim)) > max_age:
+                    os.rename(str(self.claimed / claim), str(self.pending / get_job_name(claim)))
+            except FileNotFoundError:
+                pass
+
+    def pop_result(self, name):
+        path = self.results / name
+        try:
+            result = read_file(path)
+        except FileNotFoundError:
+            return None
+        os.remove(str(path))
+        return result
+
+    def clear(self):
+        """
+        Remove everything left in the queue by an earlier run
+        """
+        for directory in (self.pending, self.claimed, self.results, self.data):
+            for name in os.listdir(str(directory)):
+                os.remove(str(directory / name))
+
+        try:
+            os.remove(str(self.path / 'STOP'))
+        except FileNotFoundError:
+            pass
+
+    def stop(self):
+        (self.path / 'STOP').touch()
+
+    @property
+    def stopped(self):
+        return (self.path / 'STOP').exists()
+
+
+# the word list of the current round by the directory of the queue and the name of the list
+# (which is different in every run, see ShardedExecutor.start)
+_word_lists = {}
+
+
+def get_word_list(queue, name):
+    # a worker only needs the word list of the current round
+    key = (str(queue.path.resolve()), name)
+    if key not in _word_lists:
+        _word_lists.clear()
+        _word_lists[key] = read_file(queue.data / name)
+    return _word_lists[key]
+
+
+def do_extract(queue, job):
+    words = get_word_list(queue, job['words'])
+    patterns = Counter()
+    for group in job['groups']:
+        patterns.update(classify.get_patterns([words[n] for n in group]))
+
+    return {'patterns': [[pattern.to_json(), count] for pattern, count in patterns.items()]}
+
+
+def do_match(queue, job):
+    words = get_word_list(queue, job['words'])
+    word_ids = {word: n for n, word in enumerate(words)}
+    patterns = [Pattern.from_json(elements) for elements in job['patterns']]
+
+    matches = classify.match_all(patterns, words)
+    return {'matches': [sorted(word_ids[word] for word in matches[pattern]) for pattern in patterns]}
+
+
+JOBS = {'extract': do_extract,
+        'match': do_match}
+
+
+def do_job(queue):
+    """
+    Do one of the pending jobs
+    :return: whether there was one
+    """
+    claimed = queue.claim()
+    if claimed is None:
+        return False
+
+    claim, job = claimed
+    queue.complete(claim, JOBS[job['kind']](queue, job))
+    return True
+
+
+def run_worker(path, wait=True, poll_interval=0.05):
+    """
+    Do the jobs in the queue
+    :param path: the directory of the queue
+    :param wait: whether to wait for more jobs (until the queue is stopped)
+        rather than return as soon as there are none
+    :param poll_interval: how long to wait before looking for new jobs again (in seconds)
+    :return: the number of jobs done
+    """
+    queue = WorkQueue(path)
+    done = 0
+
+    while True:
+        if do_job(queue):
+            done += 1
+        elif wait and not queue.stopped:
+            time.sleep(poll_interval)
+        else:
+            return done
+
+
+def split_groups(groups, pairs_per_job):
+    """
+    Split the groups into jobs with about pairs_per_job pairs of words each (keeping their order)
+    """
+    job, job_pairs = [], 0
+    for group in groups:
+        job.append(group)
+        job_pairs += classify.count_pairs(len(group))
+        if job_pairs >= pairs_per_job:
+            yield job
+            job, job_pairs = [], 0
+    if job:
+        yield job
+
+
+class ShardedExecutor:
+    def __init__(self, path, workers=0, pairs_per_job=50000, patterns_per_job=2000,
+                 poll_interval=0.05, stale_after=None):
+        """
+        :param path: the directory of the work queue
+        :param workers: the number of local worker processes to start
+            (the process which waits for the results does jobs too, so 0 works as well)
+        :param pairs_per_job: the number of pairs of words to extract patterns from in one job
+        :param patterns_per_job: the number of candidate patterns to match in one job
+        :param poll_interval:
+        :param stale_after: put the jobs claimed more than this many seconds ago back in the queue
+        """
+        self.queue = WorkQueue(path)
+        self.num_workers = workers
+        self.pairs_per_job = pairs_per_job
+        self.patterns_per_job = patterns_per_job
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+
+        self.workers = []
+        self.jobs = 0
+        self._rounds = 0
+        self._run_id = uuid.uuid4().hex[:12]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        # a queue left over from an earlier run would have its old STOP file and jobs in it
+        self.queue.clear()
+        self._run_id = uuid.uuid4().hex[:12]
+        self._rounds = 0
+
+        for _ in range(self.num_workers):
+            worker = multiprocessing.Process(target=run_worker,
+                                             args=(str(self.queue.path), True, self.poll_interval))
+            worker.start()
+            self.workers.append(worker)
+
+    def close(self):
+        self.queue.stop()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _put_words(self, words):
+        # the jobs of the previous round are all done, so its words aren't needed any more
+        if self._rounds:
+            os.remove(str(self.queue.data / self._get_words_name()))
+
+        self._rounds += 1
+        name = self._get_words_name()
+        words = list(words)
+        write_file(self.queue.data / name, words)
+        return name, words
+
+    def _get_words_name(self):
+        return 'words-{}-{:05d}.json.gz'.format(self._run_id, self._rounds)
+
+    def _run_jobs(self, kind, jobs):
+        names = []
+        for job in jobs:
+            self.jobs += 1
+            name = '{}-{:05d}-{:07d}-{}.json.gz'.format(self._run_id, self._rounds, self.jobs, kind)
+            job['kind'] = kind
+            self.queue.put(name, job)
+            names.append(name)
+
+        results = {}
+        while len(results) < len(names):
+            for name in names:
+                if name not in results:
+                    result = self.queue.pop_result(name)
+                    if result is not None:
+                        results[name] = result
+
+            if len(results) < len(names) and not do_job(self.queue):
+                if self.stale_after is not None:
+                    self.queue.requeue_stale(self.stale_after)
+                time.sleep(self.poll_interval)
+
+        return [results[name] for name in names]
+
+    def extract(self, groups):
+        """
+        Like classify.get_patterns for every group
+        :return: a Counter of the patterns (in the order they were first found)
+        """
+        name, words = self._put_words(itertools.chain.from_iterable(groups))
+        word_ids = {word: n for n, word in enumerate(words)}
+
+        jobs = ({'words': name, 'groups': [[word_ids[word] for word in group] for group in job]}
+                for job in split_groups(groups, self.pairs_per_job))
+
+        patterns = Counter()
+        for result in self._run_jobs('extract', jobs):
+            for elements, count in result['patterns']:
+                patterns[Pattern.from_json(elements)] += count
+        return patterns
+
+    def match(self, candidates, words):
+        """
+        Like classify.match_all
+        :return: an iterator of (pattern, the set of words it matches) in the order of the candidates
+        """
+        name, words = self._put_words(words)
+        candidates = list(candidates)
+
+        chunks = [candidates[n:n + self.patterns_per_job]
+                  for n in range(0, len(candidates), self.patterns_per_job)]
+        jobs = ({'words': name, 'patterns': [pattern.to_json() for pattern in chunk]}
+                for chunk in chunks)
+
+        for chunk, result in zip(chunks, self._run_jobs('match', jobs)):
+            for pattern, word_ids in zip(chunk, result['matches']):
+                yield pattern, {words[n] for n in word_ids}
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser(description='run classify in shards')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run classify, with the jobs done by workers')
+    run_parser.add_argument('words', help='the file with words (or a compiled corpus)')
+    run_parser.add_argument('--queue', required=True, help='the directory for the work queue')
+    run_parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='the number of local worker processes')
+    run_parser.add_argument('--pairs-per-job', type=int, default=50000)
+    run_parser.add_argument('--patterns-per-job', type=int, default=2000)
+    run_parser.add_argument('--casefold', action='store_true',
+                            help='ignore case in the input data')
+    run_parser.add_argument('--weighted', action='store_true',
+                            help='score patterns by the frequencies of the words they match')
+    run_parser.add_argument('--max-candidates', type=int,
+                            help='only keep this many of the most promising candidate patterns '
+                                 'in every round')
+
+    worker_parser = subparsers.add_parser('worker', help='do the jobs in a work queue')
+    worker_parser.add_argument('queue', help='the directory of the work queue')
+
+    args = arg_parser.parse_args()
+
+    if args.command == 'worker':
+        print('done {} jobs'.format(run_worker(args.queue)))
+    else:
+        the_words = corpus.read_words(args.words, casefold=args.casefold)
+        with ShardedExecutor(args.queue, args.workers, args.pairs_per_job,
+                             args.patterns_per_job) as executor:
+            result = classify.run(the_words, weighted=args.weighted,
+                                  max_candidates=args.max_candidates, shards=executor)
+
+        print('found {} patterns in {} jobs'.format(len(result), executor.jobs))
+        pprint.pprint(result)
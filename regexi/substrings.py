@@ -0,0 +1,201 @@
+"""
+Shared substrings, prefixes and suffixes of a list of words, found without comparing pairs of words.
+
+The substrings come from a generalized suffix automaton of the words: every substring of any of the words
+leads from the start state to exactly one state, and all the substrings which lead to the same state
+occur in the same words. The automaton has at most twice as many states as there are characters
+in the words, and it is built in time linear in their total length (for a bounded alphabet).
+The prefixes and suffixes come from tries of the words (and of the reversed words).
+
+Only the 'closed' strings are kept: those which occur in at least min_support words,
+and which can't be extended without occurring in fewer words.
+
+Run this module to compare the candidate patterns found this way with those from the pairs of words:
+
+    python -m regexi.substrings data/arabic_roots.txt
+"""
+
+import time
+from argparse import ArgumentParser
+
+
+class SuffixAutomaton:
+    def __init__(self, words=()):
+        # the start state is 0; for every state, the length of the longest substring leading to it,
+        # its suffix link, its transitions, and where that substring ends in one of the words
+        self.length = [0]
+        self.link = [-1]
+        self.transitions = [{}]
+        self.end = [(0, 0)]
+
+        self.words = []
+        self._support = None
+
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self.length)
+
+    def _new_state(self, length, link, transitions, end):
+        self.length.append(length)
+        self.link.append(link)
+        self.transitions.append(transitions)
+        self.end.append(end)
+        return len(self.length) - 1
+
+    def _clone(self, p, q, character, length):
+        """
+        Split the state q so that the substrings up to the given length get a state of their own,
+        and redirect the transitions on the character from p and its suffixes to it
+        """
+        clone = self._new_state(length, self.link[q], dict(self.transitions[q]), self.end[q])
+        while p != -1 and self.transitions[p].get(character) == q:
+            self.transitions[p][character] = clone
+            p = self.link[p]
+        self.link[q] = clone
+        return clone
+
+    def _extend(self, last, character, end):
+        length, link, transitions = self.length, self.link, self.transitions
+
+        # the substring is already there (as a part of an earlier word)
+        if character in transitions[last]:
+            q = transitions[last][character]
+            if length[last] + 1 == length[q]:
+                return q
+            return self._clone(last, q, character, length[last] + 1)
+
+        current = self._new_state(length[last] + 1, 0, {}, end)
+        p = last
+        while p != -1 and character not in transitions[p]:
+            transitions[p][character] = current
+            p = link[p]
+
+        if p != -1:
+            q = transitions[p][character]
+            if length[p] + 1 == length[q]:
+                link[current] = q
+            else:
+                link[current] = self._clone(p, q, character, length[p] + 1)
+
+        return current
+
+    def add(self, word):
+        word_index = len(self.words)
+        self.words.append(word)
+        self._support = None
+
+        last = 0
+        for n, character in enumerate(word):
+            last = self._extend(last, character, (word_index, n + 1))
+
+    @property
+    def support(self):
+        """
+        The number of words in which the substrings of every state occur
+        """
+        if self._support is None:
+            support = [0] * len(self)
+            last_seen = [-1] * len(self)
+
+            for word_index, word in enumerate(self.words):
+                state = 0
+                for character in word:
+                    # the state of this prefix of the word, and by its suffix links,
+                    # the states of all the substrings which end here
+                    state = self.transitions[state][character]
+                    suffix = state
+                    while suffix > 0 and last_seen[suffix] != word_index:
+                        last_seen[suffix] = word_index
+                        support[suffix] += 1
+                        suffix = self.link[suffix]
+
+            self._support = support
+        return self._support
+
+    def longest(self, state):
+        """
+        :return: the longest substring which leads to the state
+        """
+        word_index, end = self.end[state]
+        return self.words[word_index][end - self.length[state]:end]
+
+    def get_repeats(self, min_support=2, min_length=1):
+        """
+        Yield the longest substring of every state which occurs in at least min_support words
+        and can't be extended to the right without occurring in fewer words
+        :return: (substring, the number of words it occurs in) tuples
+        """
+        support = self.support
+        for state in range(1, len(self)):
+            if support[state] < min_support or self.length[state] < min_length:
+                continue
+            if any(support[next_state] == support[state]
+                   for next_state in self.transitions[state].values()):
+                continue
+            yield self.longest(state), support[state]
+
+
+def get_shared_prefixes(words, min_support=2, reverse=False):
+    """
+    Find the prefixes (or the suffixes) which are shared by at least min_support of the words
+    and can't be made longer without being shared by fewer words
+    :param words:
+    :param min_support:
+    :param reverse: find the suffixes instead
+    :return: (prefix, the number of words it begins) tuples
+    """
+    # a trie of the words, in which every node counts the words that go through it
+    root = [0, {}]
+    for word in words:
+        if reverse:
+            word = word[::-1]
+        node = root
+        for character in word:
+            node = node[1].setdefault(character, [0, {}])
+            node[0] += 1
+
+    nodes = [('', root)]
+    while nodes:
+        prefix, (count, children) = nodes.pop()
+        if prefix and count >= min_support and all(child[0] < count for child in children.values()):
+            yield (prefix[::-1] if reverse else prefix), count
+
+        for character, child in children.items():
+            if child[0] >= min_support:
+                nodes.append((prefix + character, child))
+
+
+def compare_candidates(words):
+    # imported here because classify depends on this module
+    from regexi import classify
+
+    groups = classify.group_by_distance(list(words))
+    results = {}
+    for name, extraction in classify.EXTRACTIONS.items():
+        start = time.perf_counter()
+        candidates = set()
+        for group in groups:
+            candidates.update(extraction(group))
+        seconds = time.perf_counter() - start
+        results[name] = candidates
+
+        top_patterns = classify.run(words, extraction=extraction)
+        print('{}: {} candidate patterns in {:.3f}s, top patterns {}'.format(
+            name, len(candidates), seconds, [pattern for pattern, _ in top_patterns]))
+
+    return results
+
+
+if __name__ == '__main__':
+    from regexi import corpus
+
+    arg_parser = ArgumentParser(description='compare the candidate patterns from shared substrings '
+                                            'with those from pairs of words')
+    arg_parser.add_argument('words', help='the file with words (or a compiled corpus)')
+    arg_parser.add_argument('--casefold', action='store_true',
+                            help='ignore case in the input data')
+    args = arg_parser.parse_args()
+
+    compare_candidates(corpus.read_words(args.words, casefold=args.casefold))
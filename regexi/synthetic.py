@@ -0,0 +1,126 @@
+"""
+Seeded generators of synthetic word lists, for benchmarking the scripts on large inputs.
+
+Every generator returns a list of groups of words, like the JSON files in the data directory:
+
+* root_and_pattern: words derived from consonantal roots by templates (like data/arabic_roots.txt),
+  one group per root
+* suffixation: stems which take different forms of a suffix (like data/english_plurals.json),
+  one group per form
+* harmony: stems whose vowels all come from the same harmony class (like data/finnish.json),
+  one group per class
+"""
+
+import random
+from itertools import chain
+
+CONSONANTS = 'bdfghklmnqrstwyzḥṯʿ'
+
+# C marks the slots for the consonants of the root, and = doubles the previous consonant
+TEMPLATES = ('CaCaCa', 'CaCaCū', 'CaCaCat', 'CaCaCnā', 'yaCCuCu', 'taCCuCu',
+             'CaCīC', 'CiCāCa', 'CuCuC', 'CuCayyiC', 'maCCūC', 'maCCaC', 'maCCaCa',
+             'miCCāC', 'muCāCaCa', 'iCtiCāC', 'istiCCāC', 'CāCiC', 'taCCīC',
+             'muCaC=iC', 'muCaC=aC', 'taCāCaCa', 'mutaCāCiC')
+
+SIBILANT_ENDINGS = ('s', 'sh', 'ch', 'x', 'z', 'ss')
+OTHER_ENDINGS = ('t', 'd', 'k', 'l', 'm', 'n', 'p', 'r', 'g', 'nt', 'st', 'ng', 'e', 'y', 'ow')
+ONSETS = ('b', 'br', 'c', 'cl', 'cr', 'd', 'dr', 'f', 'fl', 'g', 'gr', 'h', 'j', 'l', 'm',
+          'n', 'p', 'pl', 'r', 's', 'sp', 'st', 't', 'tr', 'v', 'w')
+VOWELS = ('a', 'e', 'i', 'o', 'u', 'ai', 'ea', 'oo')
+
+HARMONY_CLASSES = ('äöy', 'aou')
+NEUTRAL_VOWELS = 'ei'
+HARMONY_CONSONANTS = 'hjklmnprstv'
+
+
+def make_root(rng, length=3):
+    return tuple(rng.choice(CONSONANTS) for _ in range(length))
+
+
+def apply_template(root, template):
+    consonants = iter(root)
+    word = []
+    for symbol in template:
+        if symbol == 'C':
+            word.append(next(consonants))
+        elif symbol == '=':
+            word.append(word[-1])
+        else:
+            word.append(symbol)
+    return ''.join(word)
+
+
+def root_and_pattern(num_words, words_per_root=20, seed=0):
+    """
+    :param num_words: the total number of words
+    :param words_per_root: the average size of every group
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    num_roots = max(1, num_words // words_per_root)
+    roots = [make_root(rng) for _ in range(num_roots)]
+
+    groups = [[] for _ in roots]
+    for n in range(num_words):
+        root_index = n % num_roots
+        word = apply_template(roots[root_index], rng.choice(TEMPLATES))
+        groups[root_index].append(word)
+
+    return groups
+
+
+def make_stem(rng, endings):
+    syllables = [rng.choice(ONSETS) + rng.choice(VOWELS) for _ in range(rng.randint(0, 2))]
+    return ''.join(syllables) + rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(endings)
+
+
+def suffixation(num_words, special_share=0.1, seed=0):
+    """
+    :param num_words:
+    :param special_share: the share of stems ending in a sibilant (which take -es rather than -s)
+    :param seed:
+    :return: the stems ending in a sibilant and all the other stems
+    """
+    rng = random.Random(seed)
+    num_special = max(1, round(num_words * special_share))
+
+    special = [make_stem(rng, SIBILANT_ENDINGS) for _ in range(num_special)]
+    other = [make_stem(rng, OTHER_ENDINGS) for _ in range(num_words - num_special)]
+
+    return [special, other]
+
+
+def make_harmonic_stem(rng, vowels):
+    vowels = vowels + NEUTRAL_VOWELS
+    length = rng.randint(2, 5)
+    syllables = (rng.choice(HARMONY_CONSONANTS) + rng.choice(vowels) for _ in range(length))
+    return ''.join(syllables) + rng.choice(HARMONY_CONSONANTS)
+
+
+def harmony(num_words, seed=0):
+    """
+    :return: the stems with front vowels and the stems with back vowels
+    """
+    rng = random.Random(seed)
+    groups = [[] for _ in HARMONY_CLASSES]
+
+    for n in range(num_words):
+        class_index = n % len(HARMONY_CLASSES)
+        groups[class_index].append(make_harmonic_stem(rng, HARMONY_CLASSES[class_index]))
+
+    return groups
+
+
+GENERATORS = {'root_and_pattern': root_and_pattern,
+              'suffixation': suffixation,
+              'harmony': harmony}
+
+
+def flatten(groups, seed=0):
+    """
+    Put all the groups into one shuffled list of words
+    """
+    words = list(chain.from_iterable(groups))
+    random.Random(seed).shuffle(words)
+    return words
@@ -0,0 +1,166 @@
+"""
+A compact store for word lists shared by the analyzers.
+
+All words are kept in one contiguous buffer of code points,
+with an offsets array marking where every word begins and ends.
+A word's id is simply its position in the store.
+"""
+
+import sys
+from array import array
+from collections.abc import Sequence
+
+# code points are stored as native 32-bit integers,
+# so they can be decoded without going through Python-level loops
+_ENCODING = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+
+class WordView(Sequence):
+    """
+    A read-only view of one word in a store (optionally reversed).
+    Indexing returns single characters, just like indexing a string would,
+    but nothing is copied until the view is turned into a string.
+    """
+
+    __slots__ = ('store', 'word_id', 'reverse', '_start', '_end')
+
+    def __init__(self, store, word_id, reverse=False):
+        self.store = store
+        self.word_id = word_id
+        self.reverse = reverse
+        self._start, self._end = store.span(word_id)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ''.join(self[i] for i in range(*index.indices(len(self))))
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('word view index out of range')
+
+        if self.reverse:
+            position = self._end - 1 - index
+        else:
+            position = self._start + index
+
+        return chr(self.store.codepoints[position])
+
+    def __iter__(self):
+        codepoints = self.store.codepoints[self._start:self._end]
+        if self.reverse:
+            codepoints = reversed(codepoints)
+        return map(chr, codepoints)
+
+    def __str__(self):
+        word = self.store[self.word_id]
+        if self.reverse:
+            word = word[::-1]
+        return word
+
+    def __repr__(self):
+        return 'WordView({!r})'.format(str(self))
+
+
+class NgramView(Sequence):
+    """
+    A read-only view of the n-grams of one word in a store.
+    Every n-gram is a tuple of characters, as produced by generalize.ngramicise.
+    """
+
+    __slots__ = ('word', 'n')
+
+    def __init__(self, store, word_id, n=2, reverse=False):
+        self.word = WordView(store, word_id, reverse=reverse)
+        self.n = n
+
+    def __len__(self):
+        return max(0, len(self.word) - self.n + 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('n-gram view index out of range')
+
+        return tuple(self.word[index:index + self.n])
+
+    def __repr__(self):
+        return 'NgramView({!r}, n={})'.format(str(self.word), self.n)
+
+
+class WordStore(Sequence):
+    """
+    A list of words backed by a single buffer of code points.
+    Iterating over a store yields plain strings, so it can be given to
+    patternize, classify and generalize wherever they expect a list of words.
+    """
+
+    def __init__(self, codepoints, offsets):
+        """
+        :param codepoints: a sequence of code points (e.g. array('I') or a memoryview)
+        :param offsets: a sequence of len(words) + 1 offsets into the codepoints
+        """
+        self.codepoints = codepoints
+        self.offsets = offsets
+
+    @classmethod
+    def from_words(cls, words):
+        codepoints = array('I')
+        offsets = array('Q', [0])
+
+        for word in words:
+            codepoints.frombytes(str(word).encode(_ENCODING))
+            offsets.append(len(codepoints))
+
+        return cls(codepoints, offsets)
+
+    def span(self, word_id):
+        if word_id < 0:
+            word_id += len(self)
+        if not 0 <= word_id < len(self):
+            raise IndexError('word id out of range')
+        return self.offsets[word_id], self.offsets[word_id + 1]
+
+    def word_length(self, word_id):
+        start, end = self.span(word_id)
+        return end - start
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, word_id):
+        if isinstance(word_id, slice):
+            return [self[i] for i in range(*word_id.indices(len(self)))]
+
+        start, end = self.span(word_id)
+        return self.codepoints[start:end].tobytes().decode(_ENCODING)
+
+    def __iter__(self):
+        for word_id in range(len(self)):
+            yield self[word_id]
+
+    def __repr__(self):
+        return 'WordStore({} words)'.format(len(self))
+
+    def view(self, word_id, reverse=False):
+        return WordView(self, word_id, reverse=reverse)
+
+    def views(self, reverse=False):
+        for word_id in range(len(self)):
+            yield WordView(self, word_id, reverse=reverse)
+
+    def reversed_views(self):
+        return self.views(reverse=True)
+
+    def ngram_views(self, n=2, reverse=False):
+        for word_id in range(len(self)):
+            yield NgramView(self, word_id, n=n, reverse=reverse)
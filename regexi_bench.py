@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for patternize, classify and generalize on synthetic word lists
+(see regexi/synthetic.py), reporting the time and the peak memory of every stage.
+
+    ./regexi_bench.py --sizes 100 1000 10000 100000
+    ./regexi_bench.py classify --sizes 100 300 1000
+"""
+
+import contextlib
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+
+from regexi import classify, generalize, patternize, synthetic
+from regexi.matchstore import MemoryPool
+
+
+def measure(function, *args, memory=True, **kwargs):
+    """
+    Time a function, then (optionally) run it again under tracemalloc to get its peak memory.
+    Any output of the function is discarded.
+    :return: the result of the function, the time in seconds and the peak memory in bytes (or None)
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                function(*args, **kwargs)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+    return result, seconds, peak
+
+
+def bench_patternize(size, seed=0, memory=True):
+    # all the words come from the same root, so that they do have a common pattern
+    words = synthetic.root_and_pattern(size, words_per_root=size, seed=seed)[0]
+
+    _, seconds, peak = measure(patternize.find_pattern, words, memory=memory)
+    yield 'find_pattern', seconds, peak
+
+
+def get_all_patterns(groups):
+    return set(itertools.chain.from_iterable(classify.get_patterns(group) for group in groups))
+
+
+def rematch(patterns, words):
+    return {pattern: set(classify.get_regex_matches(pattern, words)) for pattern in patterns}
+
+
+def get_top_score(patterns):
+    try:
+        return classify.get_top_score(patterns)
+    except ValueError:
+        return None
+
+
+def bench_classify(size, seed=0, memory=True):
+    """
+    Time every stage of the first round of classify.get_top_patterns
+    """
+    words = synthetic.flatten(synthetic.root_and_pattern(size, seed=seed), seed=seed)
+
+    groups, seconds, peak = measure(classify.group_by_distance, list(words), memory=memory)
+    yield 'grouping', seconds, peak
+
+    candidates, seconds, peak = measure(get_all_patterns, groups, memory=memory)
+    yield 'pair extraction', seconds, peak
+
+    matches, seconds, peak = measure(classify.find_all_matches, candidates, words, memory=memory)
+    yield 'matching', seconds, peak
+
+    collapsed, seconds, peak = measure(classify.collapse_subsets, matches, memory=memory)
+    yield 'collapsing', seconds, peak
+
+    rematched, seconds, peak = measure(rematch, collapsed, words, memory=memory)
+    yield 'rematching', seconds, peak
+
+    _, seconds, peak = measure(get_top_score, rematched, memory=memory)
+    yield 'scoring', seconds, peak
+
+
+def run_with_checkpoint(words, path, interval=0):
+    checkpoint = classify.Checkpoint(path, interval)
+    classify.run(words, checkpoint=checkpoint)
+    return checkpoint
+
+
+def bench_checkpoint(size, seed=0, memory=True):
+    """
+    Compare a whole classify run with and without saving a checkpoint at every opportunity
+    (the worst case of the overhead, since by default checkpoints are saved at most once a minute)
+    """
+    words = synthetic.flatten(synthetic.root_and_pattern(size, seed=seed), seed=seed)
+
+    _, seconds, peak = measure(classify.run, words, memory=memory)
+    yield 'no checkpoints', seconds, peak
+
+    file_descriptor, path = tempfile.mkstemp(suffix='.json.gz')
+    os.close(file_descriptor)
+    try:
+        checkpoint, seconds, peak = measure(run_with_checkpoint, words, path, memory=memory)
+        yield 'checkpoints', seconds, peak
+        yield 'saving ({} saves)'.format(checkpoint.saves), checkpoint.seconds, None
+    finally:
+        os.remove(path)
+
+
+def count_patterns(groups):
+    patterns = Counter()
+    for group in groups:
+        patterns.update(classify.get_patterns(group))
+    return patterns
+
+
+def look_up_patterns(patterns, copies, repeats=10):
+    """
+    Look every pattern up in the dict (as a pattern made again from the same elements), like
+    the stages which keep Counters and dicts of sets of patterns do
+    """
+    found = 0
+    for _ in range(repeats):
+        for pattern in copies:
+            found += pattern in patterns
+            found += len(patterns[pattern])
+    return found
+
+
+def score_patterns(patterns):
+    # get_pattern_scores is a generator, so nothing is scored until it is consumed
+    return list(classify.get_pattern_scores(patterns))
+
+
+class UninternedPattern(classify.Pattern):
+    """
+    A pattern as they were before they were interned, as the baseline of bench_pattern_dicts:
+    every pattern made is a new object, whose hash is computed again every time it is needed,
+    and which is only equal to another one if their keys are
+    """
+
+    def __new__(cls, pattern, clean_up=True):
+        if clean_up:
+            pattern = cls._clean_up(pattern)
+        pattern = cls._canonicalize(pattern)
+
+        self = object.__new__(cls)
+        self.pattern = pattern
+        self.skeleton = tuple(element for element in pattern if element)
+        self._regex = None
+        self._key = tuple(element.value if isinstance(element, patternize.AmbiguousElement)
+                          else element for element in pattern)
+        return self
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __eq__(self, other):
+        if not isinstance(other, InternedPattern):
+            return NotImplemented
+        return self._key == other._key
+
+
+InternedPattern = classify.Pattern
+
+
+@contextlib.contextmanager
+def uninterned_patterns():
+    """
+    Make classify (and everything which makes patterns through it) make UninternedPatterns
+    """
+    classify.Pattern = UninternedPattern
+    try:
+        yield
+    finally:
+        classify.Pattern = InternedPattern
+
+
+def time_pattern_dicts(words, groups, memory=True):
+    candidates, seconds, peak = measure(count_patterns, groups, memory=memory)
+    yield 'counting', seconds, peak
+
+    matches = classify.find_all_matches(candidates, words)
+    copies = [classify.Pattern.from_json(pattern.to_json()) for pattern in matches]
+    _, seconds, peak = measure(look_up_patterns, matches, copies, memory=memory)
+    yield 'looking up', seconds, peak
+
+    collapsed, seconds, peak = measure(classify.collapse_subsets, matches, memory=memory)
+    yield 'collapsing', seconds, peak
+
+    rematched = rematch(collapsed, words)
+    _, seconds, peak = measure(score_patterns, rematched, memory=memory)
+    yield 'scoring', seconds, peak
+
+
+def bench_pattern_dicts(size, seed=0, memory=True):
+    """
+    Time the stages of classify which mostly consist of using patterns as keys of dicts,
+    both with the patterns as they were before they were interned (see UninternedPattern) and as they are now
+    """
+    words = synthetic.flatten(synthetic.root_and_pattern(size, seed=seed), seed=seed)
+    groups = classify.group_by_distance(list(words))
+
+    with uninterned_patterns():
+        before = list(time_pattern_dicts(words, groups, memory))
+    after = list(time_pattern_dicts(words, groups, memory))
+
+    for (stage, seconds_before, peak_before), (_, seconds_after, peak_after) in zip(before, after):
+        yield stage + ' (before)', seconds_before, peak_before
+        yield stage + ' (after)', seconds_after, peak_after
+
+
+def run_with_match_set_budget(words, budget):
+    pool = MemoryPool(budget)
+    classify.run(words, memory_pool=pool)
+    return pool
+
+
+def bench_match_set_budget(size, seed=0, memory=True, budget=2 ** 16):
+    """
+    Compare a whole classify run with all the match sets in memory and with those which don't fit
+    in budget bytes kept on disk. The budget only counts the match sets, so the peak memory of the whole run
+    (everything Python allocated while it ran) is shown next to it, along with the peak of the match sets
+    """
+    words = synthetic.flatten(synthetic.root_and_pattern(size, seed=seed), seed=seed)
+
+    _, seconds, peak = measure(classify.run, words, memory=memory)
+    yield 'in memory', seconds, peak
+
+    pool, seconds, peak = measure(run_with_match_set_budget, words, budget, memory=memory)
+    yield 'spilled', seconds, peak
+    yield 'budget: {} KiB'.format(budget // 1024), 0.0, budget
+    yield 'match sets peak', 0.0, pool.peak
+    yield 'spills: {}, page-ins: {}'.format(pool.spills, pool.page_ins), 0.0, None
+
+
+def bench_generalize(size, seed=0, memory=True):
+    for name in ('suffixation', 'harmony'):
+        groups = synthetic.GENERATORS[name](size, seed=seed)
+        _, seconds, peak = measure(generalize.run, groups, 1, memory=memory)
+        yield name, seconds, peak
+
+
+BENCHMARKS = {'patternize': bench_patternize,
+              'classify': bench_classify,
+              'generalize': bench_generalize,
+              'checkpoint': bench_checkpoint,
+              'patterns': bench_pattern_dicts,
+              'spill': bench_match_set_budget}
+
+# classify compares every pair of words in every group, so it is only run up to this size by default
+MAX_CLASSIFY_SIZE = 1000
+CLASSIFY_BENCHMARKS = {'classify', 'checkpoint', 'patterns', 'spill'}
+
+DATA_FILES = ('arabic_roots.txt', 'english_plurals.json', 'finnish.json')
+POOL_SIZES = (20, 100, 500)
+
+
+def read_data_words(path):
+    if path.suffix == '.json':
+        with path.open() as file:
+            return Counter(itertools.chain.from_iterable(json.load(file)))
+
+    with path.open() as file:
+        return Counter(line.strip() for line in file if line.strip())
+
+
+def compare_candidate_pools(pool_sizes=POOL_SIZES, data_files=DATA_FILES):
+    """
+    Run classify on the data sets with every size of the candidate pool (see classify.get_candidate_pool),
+    and compare the patterns found to the ones found with all the candidates
+    """
+    data_dir = Path(__file__).parent / 'data'
+    results = []
+
+    for data_file in data_files:
+        words = read_data_words(data_dir / data_file)
+
+        full, seconds, _ = measure(classify.run, words, memory=False)
+        full_regexes = {pattern.regex for pattern, _ in full}
+        print('{:<24} {:>7} {:>10.4f}s {:>4} patterns'.format(data_file, 'all', seconds, len(full)))
+
+        for pool_size in pool_sizes:
+            result, seconds, _ = measure(classify.run, words, max_candidates=pool_size, memory=False)
+            shared = len(full_regexes.intersection(pattern.regex for pattern, _ in result))
+            results.append({'data': data_file, 'max_candidates': pool_size, 'seconds': seconds,
+                            'patterns': len(result), 'shared_patterns': shared,
+                            'all_candidates_patterns': len(full)})
+            print('{:<24} {:>7} {:>10.4f}s {:>4} patterns, {} of them also found with all candidates'
+                  .format(data_file, pool_size, seconds, len(result), shared))
+
+    return results
+
+
+def align_pairs(pairs, engine):
+    return [patternize.find_pattern(pair, engine=engine)[0] for pair in pairs]
+
+
+def compare_engines(data_files=DATA_FILES, max_pairs=5000):
+    """
+    Align pairs of words from the data sets with every engine of patternize.find_pattern,
+    and compare the time they take and the patterns they make
+    (how many of the patterns match both words, and how many elements they have)
+    """
+    data_dir = Path(__file__).parent / 'data'
+    results = []
+
+    for data_file in data_files:
+        words = list(read_data_words(data_dir / data_file))
+        pairs = list(itertools.islice(itertools.combinations(words, 2), max_pairs))
+        found = {}
+
+        for engine in sorted(patternize.ENGINES):
+            patterns, seconds, _ = measure(align_pairs, pairs, engine, memory=False)
+            patterns = [classify.Pattern(pattern) if pattern else None for pattern in patterns]
+            found[engine] = patterns
+
+            made = [(pattern, pair) for pattern, pair in zip(patterns, pairs) if pattern is not None]
+            valid = sum(1 for pattern, pair in made
+                        if all(re.match(pattern.regex, word) for word in pair))
+            mean_length = sum(len(pattern) for pattern, _ in made) / len(made) if made else 0.0
+
+            results.append({'data': data_file, 'engine': engine, 'pairs': len(pairs), 'seconds': seconds,
+                            'patterns': len(made), 'valid_patterns': valid, 'mean_length': mean_length})
+            print('{:<24} {:<10} {:>6} pairs {:>9.4f}s {:>6} patterns, {} match both words, '
+                  'mean length {:.2f}'.format(data_file, engine, len(pairs), seconds, len(made), valid,
+                                              mean_length))
+
+        same = sum(1 for patterns in zip(*found.values()) if len(set(patterns)) == 1)
+        print('{:<24} the engines made the same pattern for {} of the pairs'.format(data_file, same))
+
+    return results
+
+
+def run(names, sizes, seed=0, memory=True, max_classify_size=MAX_CLASSIFY_SIZE):
+    results = []
+
+    for name in names:
+        for size in sizes:
+            if name in CLASSIFY_BENCHMARKS and size > max_classify_size:
+                print('{:<12} {:>7} skipped (see --max-classify-size)'.format(name, size))
+                continue
+
+            for stage, seconds, peak in BENCHMARKS[name](size, seed=seed, memory=memory):
+                peak_kib = None if peak is None else peak / 1024
+                results.append({'benchmark': name, 'size': size, 'stage': stage,
+                                'seconds': seconds, 'peak_kib': peak_kib})
+
+                if peak_kib is None:
+                    print('{:<12} {:>7} {:<20} {:>10.4f}s'.format(name, size, stage, seconds))
+                else:
+                    print('{:<12} {:>7} {:<20} {:>10.4f}s {:>12.1f} KiB'.format(
+                        name, size, stage, seconds, peak_kib))
+
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument('benchmarks', nargs='*',
+                            help='the benchmarks to run: {} (all by default)'.format(
+                                ', '.join(sorted(BENCHMARKS))))
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                            help='the numbers of words to generate')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--max-classify-size', type=int, default=MAX_CLASSIFY_SIZE,
+                            help='skip classify for bigger sizes')
+    arg_parser.add_argument('--no-memory', action='store_true',
+                            help="don't measure peak memory (halves the running time)")
+    arg_parser.add_argument('--pool-sizes', type=int, nargs='+',
+                            help='instead of the benchmarks, compare the patterns classify finds '
+                                 'in the data sets with these sizes of the candidate pool')
+    arg_parser.add_argument('--engines', action='store_true',
+                            help='instead of the benchmarks, compare the engines of patternize.find_pattern '
+                                 'on pairs of words from the data sets')
+    arg_parser.add_argument('--output', help='write the results to this JSON file')
+    args = arg_parser.parse_args()
+
+    for the_name in args.benchmarks:
+        if the_name not in BENCHMARKS:
+            arg_parser.error('unknown benchmark: {}'.format(the_name))
+
+    if args.engines:
+        the_results = compare_engines()
+    elif args.pool_sizes:
+        the_results = compare_candidate_pools(args.pool_sizes)
+    else:
+        the_results = run(args.benchmarks or sorted(BENCHMARKS), args.sizes, seed=args.seed,
+                          memory=not args.no_memory, max_classify_size=args.max_classify_size)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(the_results, output_file, indent=2)
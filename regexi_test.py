@@ -1,57 +1,304 @@
-from argparse import ArgumentParser
-from collections import Counter
-from itertools import chain, tee
-from pprint import pprint
+#!/usr/bin/env python3
+"""
+Validates the regexes found by patternize, classify and generalize against word lists.
+
+Every regex is compiled once and run over a stream of words in a pool of worker processes,
+and a summary of the precision and recall of every pattern is printed:
+
+* on a text file (or a compiled corpus), the patternize regex should match every word,
+  and every classify pattern should match exactly the words classify says it matches
+* on a JSON file with groups of words (like data/english_plurals.json), patternize is run on every group,
+  classify on all the groups together, and generalize on the groups, and every regex is compared
+  to the group it matches best
+
+    ./regexi_test.py data/arabic_roots.txt
+    ./regexi_test.py data/english_plurals.json --analyzers generalize classify
+
+With --stress, the analyzers are instead run many times at once in a pool of threads,
+and their results are checked against those of a serial run:
+
+    ./regexi_test.py data/english_signatures.json --stress 20 --threads 8
+"""
+
+import itertools
+import json
+import multiprocessing
+import random
 import re
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, namedtuple
+from itertools import chain
+
+from regexi import classify, corpus, generalize, patternize
+
+# this is a script, not a test module for pytest
+__test__ = False
+
+ANALYZERS = ('patternize', 'classify', 'generalize')
+
+# a regex to validate: which analyzer found it,
+# and the words it should match (or None if it should match every word)
+Target = namedtuple('Target', 'analyzer regex expected')
+
+
+def is_groups_file(path):
+    return str(path).endswith('.json')
+
+
+def load_groups(path, casefold=False):
+    with open(str(path)) as file:
+        groups = json.load(file)
+
+    if casefold:
+        groups = [[word.casefold() for word in group] for group in groups]
+    return groups
+
+
+def stream_words(path, casefold=False):
+    """
+    Yield the words of a text file (line by line) or of a compiled corpus, without reading all of them first.
+    """
+    if corpus.is_corpus(path):
+        with corpus.Corpus(path) as compiled:
+            for word in compiled.tokens():
+                yield word.casefold() if casefold else word
+    else:
+        with open(str(path)) as file:
+            yield from corpus.tokenize(file, casefold=casefold)
+
+
+def get_best_group(regex, groups):
+    """
+    :return: the group with the most words the regex matches
+    """
+    compiled = re.compile(regex)
+    return max(groups, key=lambda group: sum(1 for word in group if compiled.match(word)))
+
+
+def get_targets(path, analyzers=ANALYZERS, casefold=False, ngrams=1):
+    """
+    Run the analyzers on the file and collect the regexes they find
+    :return: a list of Targets
+    """
+    targets = []
+
+    if is_groups_file(path):
+        groups = load_groups(path, casefold)
+
+        if 'patternize' in analyzers:
+            for group in groups:
+                regex = patternize.run_find_all(group)
+                if regex:
+                    targets.append(Target('patternize', regex, frozenset(group)))
 
-import patternize
+        if 'classify' in analyzers:
+            for pattern, _ in classify.run(list(chain.from_iterable(groups))):
+                best_group = get_best_group(pattern.regex, groups)
+                targets.append(Target('classify', pattern.regex, frozenset(best_group)))
 
-def test_regex_matches(regex, words):
-    for word in words:
-        match = re.match(regex, word)
-        if match:
-            yield word, True
-        else:
-            yield word, False
+        if 'generalize' in analyzers:
+            regex_rules = generalize.run(groups, ngrams)[0]
+            if isinstance(regex_rules, str):
+                regex_rules = [regex_rules]
+            for regex in regex_rules or ():
+                if regex:
+                    best_group = get_best_group(regex, groups)
+                    targets.append(Target('generalize', regex, frozenset(best_group)))
 
-def test_all(regex, words, must_work=True):
-    if not regex:
-        print('no regex given')
-        return False
+        return targets
 
-    results1, results2 = tee(test_regex_matches(regex, words), 2)
+    if 'patternize' in analyzers:
+        regex = patternize.run_find_all(sorted(set(stream_words(path, casefold))))
+        if regex:
+            targets.append(Target('patternize', regex, None))
 
-    test_status = all(result for _, result in results1)
+    if 'classify' in analyzers:
+        words = corpus.read_words(path, casefold=casefold)
+        for pattern, matches in classify.run(words):
+            targets.append(Target('classify', pattern.regex, frozenset(matches)))
 
-    if not must_work:
-        test_status = not test_status
+    if 'generalize' in analyzers:
+        print('generalize needs a JSON file with groups of words, skipping it')
 
-    if test_status:
-        print('all words passed the test')
-        return True
+    return targets
+
+
+_regexes = None
+_expected = None
+
+
+def _init_worker(regexes, expected):
+    global _regexes, _expected
+    _regexes = [re.compile(regex) for regex in regexes]
+    _expected = expected
+
+
+def _count_chunk(words):
+    """
+    :return: the number of words every regex matched, of those the number it should have matched,
+        and the number of words it should have matched
+    """
+    counts = []
+    for regex, expected in zip(_regexes, _expected):
+        matched = correct = should_match = 0
+        for word in words:
+            is_expected = expected is None or word in expected
+            if regex.match(word):
+                matched += 1
+                correct += is_expected
+            should_match += is_expected
+        counts.append((matched, correct, should_match))
+    return counts
+
+
+def chunk_words(words, chunk_size):
+    words = iter(words)
+    while True:
+        chunk = list(itertools.islice(words, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate(targets, words, processes=None, chunk_size=10000):
+    """
+    Run every regex over the words in a pool of processes
+    :param targets: a list of Targets
+    :param words: an iterable of words (which is consumed in chunks)
+    :param processes: the number of worker processes (the number of CPUs by default)
+    :param chunk_size: the number of words sent to a worker at a time
+    :return: a list of dicts with the counts, the precision and the recall of every regex
+    """
+    totals = [[0, 0, 0] for _ in targets]
+    regexes = [target.regex for target in targets]
+    expected = [target.expected for target in targets]
+
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(regexes, expected)) as pool:
+        for counts in pool.imap_unordered(_count_chunk, chunk_words(words, chunk_size)):
+            for total, count in zip(totals, counts):
+                for n, value in enumerate(count):
+                    total[n] += value
+
+    summary = []
+    for target, (matched, correct, should_match) in zip(targets, totals):
+        summary.append({'analyzer': target.analyzer,
+                        'regex': target.regex,
+                        'matched': matched,
+                        'expected': should_match,
+                        'precision': correct / matched if matched else 0.0,
+                        'recall': correct / should_match if should_match else 0.0})
+    return summary
+
+
+def print_summary(summary):
+    print('{:<11} {:>9} {:>9} {:>9} {:>9}  {}'.format('analyzer', 'matched', 'expected',
+                                                       'precision', 'recall', 'regex'))
+    for row in summary:
+        print('{analyzer:<11} {matched:>9} {expected:>9} {precision:>9.3f} {recall:>9.3f}  {regex}'
+              .format(**row))
+
+
+def run_validation(path, analyzers=ANALYZERS, casefold=False, processes=None, chunk_size=10000):
+    targets = get_targets(path, analyzers, casefold)
+    if not targets:
+        print('no regexes to validate')
+        return []
+
+    if is_groups_file(path):
+        words = chain.from_iterable(load_groups(path, casefold))
     else:
-        for word, status in results2:
-            if status is not must_work:
-                print('{} failed'.format(word))
-        return False
+        words = stream_words(path, casefold)
 
+    summary = validate(targets, words, processes, chunk_size)
+    print_summary(summary)
+    return summary
 
 
+def get_runs(path, analyzers=ANALYZERS, casefold=False, seed=0):
+    """
+    :return: a dict of the analyzers and functions which run them on the words in the file
+        (all the runs share the same words, which they must not change)
+    """
+    runs = {}
+
+    if is_groups_file(path):
+        groups = load_groups(path, casefold)
+        words = list(chain.from_iterable(groups))
+
+        if 'patternize' in analyzers:
+            runs['patternize'] = lambda: [patternize.run_find_all(group) for group in groups]
+        if 'generalize' in analyzers:
+            # the groups themselves are compared in threads too
+            runs['generalize'] = lambda: generalize.run(groups, 1, rng=random.Random(seed), threads=2)
+    else:
+        words = corpus.read_words(path, casefold=casefold)
 
-def run_test(file, mode):
-    regex = patternize.run(file, False, verbose=True)
+        if 'patternize' in analyzers:
+            runs['patternize'] = lambda: patternize.run_find_all(sorted(words))
+        if 'generalize' in analyzers:
+            print('generalize needs a JSON file with groups of words, skipping it')
 
-    with open(file) as word_list:
-        words = re.findall('\w+', word_list.read())
+    if 'classify' in analyzers:
+        runs['classify'] = lambda: classify.run(words)
 
+    return runs
 
-    print('testing', regex)
-    result = test_all(regex, words)
+
+def stress_test(runs, repeats=20, threads=8):
+    """
+    Run every analyzer many times at once (all the analyzers at the same time) in a pool of threads,
+    and compare the results with those of a serial run
+    :param runs: a dict of the analyzers and functions which run them
+    :param repeats: how many times every analyzer is run
+    :param threads: the number of threads
+    :return: a dict of the analyzers and how many of their runs had different results
+    """
+    expected = {analyzer: run() for analyzer, run in runs.items()}
+
+    with ThreadPoolExecutor(threads) as pool:
+        futures = [(analyzer, pool.submit(run)) for _ in range(repeats) for analyzer, run in runs.items()]
+        mismatches = Counter({analyzer: 0 for analyzer in runs})
+        for analyzer, future in futures:
+            if future.result() != expected[analyzer]:
+                mismatches[analyzer] += 1
+
+    for analyzer, count in mismatches.items():
+        print('{}: {} runs in {} threads, {} different from the serial run'.format(analyzer, repeats,
+                                                                              threads, count))
+    return mismatches
 
 
 if __name__ == '__main__':
     arg_parser = ArgumentParser()
-    arg_parser.add_argument('file', help='file with a list of words')
-    arg_parser.add_argument('--mode', choices=('all', 'vs'), default='all')
+    arg_parser.add_argument('file', help='file with a list of words, a compiled corpus, '
+                                         'or a JSON file with groups of words')
+    arg_parser.add_argument('--analyzers', nargs='+', choices=ANALYZERS, default=ANALYZERS,
+                            help='the scripts whose regexes should be validated')
+    arg_parser.add_argument('--casefold', action='store_true',
+                            help='ignore case in the input data')
+    arg_parser.add_argument('--processes', type=int,
+                            help='the number of worker processes (the number of CPUs by default)')
+    arg_parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='the number of words sent to a worker process at a time')
+    arg_parser.add_argument('--output', help='also write the summary to this JSON file')
+    arg_parser.add_argument('--stress', type=int, metavar='N',
+                            help='instead of validating the regexes, run every analyzer N times at once '
+                                 'and check that the results are the same as in a serial run')
+    arg_parser.add_argument('--threads', type=int, default=8,
+                            help='the number of threads for --stress')
     args = arg_parser.parse_args()
-    run_test(args.file, args.mode)
+
+    if args.stress:
+        the_mismatches = stress_test(get_runs(args.file, args.analyzers, args.casefold), args.stress,
+                                     args.threads)
+        sys.exit(1 if any(the_mismatches.values()) else 0)
+
+    the_summary = run_validation(args.file, args.analyzers, args.casefold, args.processes,
+                                 args.chunk_size)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(the_summary, output_file, indent=2, ensure_ascii=False)
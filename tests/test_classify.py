@@ -0,0 +1,244 @@
+"""
+Checks that the engines and modes of classify give the same results as the plain run on small inputs
+"""
+
+import itertools
+import pickle
+import re
+import sys
+from collections import Counter
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+from regexi import classify, minhash, online, shard, synthetic
+from regexi.automaton import PatternMatcher
+from regexi.classify import Pattern
+from regexi.instrument import Instrumentation
+from regexi.matchstore import MatchStore, MemoryPool
+from regexi.patternize import AmbiguousElement
+from regexi.resultcache import ResultCache
+from regexi.substrings import SuffixAutomaton, get_shared_prefixes
+
+DATA = Path(__file__).parent.parent / 'data'
+
+
+@pytest.fixture(scope='module')
+def words():
+    return classify.corpus.read_words(DATA / 'arabic_roots.txt')
+
+
+@pytest.fixture(scope='module')
+def expected(words):
+    return classify.run(words)
+
+
+@pytest.fixture(scope='module')
+def candidates(words):
+    groups = classify.group_by_distance(list(words))
+    return set(itertools.chain.from_iterable(classify.get_patterns(group) for group in groups))
+
+
+def test_automaton_matches_re(words, candidates):
+    matched = PatternMatcher(candidates).match_sets(words)
+    for pattern in candidates:
+        assert matched[pattern] == {word for word in words if re.match(pattern.regex, word)}
+
+
+def test_weights_same_as_duplicates(words):
+    assert classify.run(list(words.elements())) == classify.run(words)
+
+
+def test_sampling_every_pair(words, expected):
+    sampling = classify.Sampling(budget=10 ** 9, seed=0)
+    result = classify.run(words, sampling=sampling)
+    assert sampling.coverage == 1.0
+    assert {pattern for pattern, _ in result} == {pattern for pattern, _ in expected}
+
+
+def test_sampling_every_group():
+    sampling = classify.Sampling(budget=10, seed=0)
+    groups = [['kataba', 'kutiba', 'kātib', 'maktab', 'kitāb', 'makātib', 'kutub'], ['darasa', 'dars'],
+              ['nazala', 'nuzul']]
+    patterns = classify.get_sampled_patterns(groups, sampling)
+    # (the two small groups would get no pairs at all if their share of the budget were just rounded)
+    for group in groups[1:]:
+        assert any(all(re.match(pattern.regex, word) for word in group) for pattern in patterns)
+    assert sampling.sampled_pairs == 9 + 1 + 1
+
+
+def test_sampling_reused(words):
+    sampling = classify.Sampling(budget=100, time_limit=0, seed=0)
+    classify.run(words, sampling=sampling)
+    assert sampling.timed_out
+
+    sampling.time_limit = None
+    classify.run(words, sampling=sampling)
+    assert not sampling.timed_out
+    assert sampling.sampled_pairs <= sampling.total_pairs
+
+
+def test_minhash_groups_every_word_once(words):
+    groups = classify.group_by_minhash(list(words))
+    assert sorted(itertools.chain.from_iterable(groups)) == sorted(words)
+    assert minhash.rand_index(groups, groups) == 1.0
+
+
+def test_instrumentation_same_result(words, expected):
+    instrument = Instrumentation()
+    assert classify.run(words, instrument=instrument) == expected
+    assert instrument.counters['iterations'] > 0
+
+
+def test_online_first_batch(words, expected):
+    classifier = online.OnlineClassifier()
+    classifier.add(words)
+    assert {pattern for pattern, _ in classifier.result()} == {pattern for pattern, _ in expected}
+
+
+def test_checkpoint_resume(words, expected, tmp_path):
+    path = tmp_path / 'checkpoint.json.gz'
+    checkpoint = classify.Checkpoint(path, interval=0)
+    found = classify.stream_patterns(words, checkpoint=checkpoint)
+    next(found)
+    found.close()
+
+    assert classify.run(words, checkpoint=classify.Checkpoint.load(path, interval=0)) == expected
+
+
+def test_budget_not_exhausted(words, expected):
+    result = classify.run(words, budget=classify.Budget(max_pairs=10 ** 9))
+    assert result.completed
+    assert result == expected
+
+
+def test_budget_ran_out_not_completed():
+    # (the budget runs out while the words are grouped, so there is nothing to score)
+    words = synthetic.flatten(synthetic.root_and_pattern(2000, seed=0), seed=0)
+    budget = classify.Budget(time_limit=0.002)
+    result = classify.run(words, budget=budget)
+    assert budget.ran_out
+    assert result.completed is False
+
+
+def test_candidate_pool_with_room_for_all(words, expected, candidates):
+    assert classify.run(words, max_candidates=len(candidates)) == expected
+
+
+def test_shards(words, expected, tmp_path):
+    with shard.ShardedExecutor(tmp_path / 'queue', workers=0) as executor:
+        assert classify.run(words, shards=executor) == expected
+
+
+def test_ratio_cache_off(words, expected):
+    assert classify.run(words, ratio_cache=classify.RatioCache(0)) == expected
+
+
+def test_batched_ratios():
+    word = 'kataba'
+    candidates = ['kutiba', 'maktab', 'darasa', 'kitāb', 'kataba']
+    ratios = classify.get_ratios(word, candidates)
+    assert ratios == pytest.approx([classify.lev.ratio(word, candidate) for candidate in candidates])
+
+
+def test_stream_same_patterns(words, expected):
+    streamed = [pattern for pattern, _, _ in classify.stream_patterns(words)]
+    assert sorted(streamed, key=str) == sorted((pattern for pattern, _ in expected), key=str)
+
+
+def test_patterns_interned():
+    pattern = Pattern(['k', None, 't', None, 'b'])
+    assert Pattern(['k', None, None, 't', None, 'b']) is pattern
+    assert pickle.loads(pickle.dumps(pattern)) is pattern
+    assert Pattern.from_json(pattern.to_json()) is pattern
+    assert Pattern([None, AmbiguousElement('a'), None]) is Pattern([None, 'a', None])
+
+
+def test_anchors_count_towards_length():
+    assert len(Pattern(['^', None, 'a', '$'], clean_up=False)) == 3
+    assert len(Pattern([None, 'a', '$'], clean_up=False)) == 2
+
+
+def test_suffix_automaton_repeats():
+    test_words = ['kataba', 'kutiba', 'maktab', 'katib', 'abab', 'abba', 'baba']
+    found = dict(SuffixAutomaton(test_words).get_repeats())
+
+    substrings = {word[i:j] for word in test_words
+                  for i in range(len(word)) for j in range(i + 1, len(word) + 1)}
+    support = {substring: sum(substring in word for word in test_words) for substring in substrings}
+    characters = set(''.join(test_words))
+    # the substrings in at least 2 words which can't be extended on either side in as many words
+    closed = {substring: count for substring, count in support.items()
+              if count >= 2 and all(support.get(substring + character, 0) < count
+                                    and support.get(character + substring, 0) < count
+                                    for character in characters)}
+
+    # (a substring which occurs after different characters in one of the words has a state of its own,
+    # so it is found as well, even if it always occurs in the same words as a longer one)
+    assert all(found[substring] == count for substring, count in closed.items())
+    assert all(support[substring] == count for substring, count in found.items())
+
+
+def test_shared_prefixes():
+    test_words = ['kataba', 'katib', 'kutiba', 'maktab']
+    assert dict(get_shared_prefixes(test_words)) == {'k': 3, 'kat': 2}
+    assert dict(get_shared_prefixes(test_words, reverse=True)) == {'ba': 2, 'b': 2}
+
+
+def test_suffix_candidates(words):
+    result = classify.run(words, extraction=classify.get_substring_patterns)
+    for pattern, matches in result:
+        assert all(re.match(pattern.regex, word) for word in matches)
+
+
+@pytest.mark.parametrize('budget', [0, 4096, 2 ** 30])
+def test_spilled_same_as_in_memory(words, expected, budget):
+    pool = MemoryPool(budget)
+    assert classify.run(words, memory_pool=pool) == expected
+    if not budget:
+        assert pool.spills
+
+
+def test_scoring_stored_patterns_reads_sets_back_in_blocks(words, candidates):
+    matches = classify.find_all_matches(candidates, words)
+    # (a quarter of the sets fit in the budget, so they are scored in blocks of about an eighth of them)
+    pool = MemoryPool(sum(sys.getsizeof(word_set) for word_set in matches.values()) // 4)
+    pool.set_words(words)
+    store = MatchStore(pool, ((pattern, set(word_set)) for pattern, word_set in matches.items()))
+
+    pool.page_ins = 0
+    assert classify.get_top_score(store) == classify.get_top_score(matches)
+    # every set is read back at most once for every block (and once more to make the blocks)
+    assert pool.page_ins <= 10 * len(store)
+
+
+def test_cached_same_as_uncached(words, expected, tmp_path):
+    cache = ResultCache(tmp_path)
+    assert classify.run(words, result_cache=cache) == expected
+    assert classify.run(list(words.elements()), result_cache=cache) == expected
+    assert cache.hits == 1
+
+    # (the words are grouped in the order they are given, so another order is another result)
+    reordered = Counter(reversed(list(words)))
+    assert classify.run(reordered, result_cache=cache) == classify.run(reordered)
+    assert cache.hits == 1
+
+
+@pytest.mark.parametrize('grouping', [lambda words, cache=None: classify.group_by_distance(words, cache=cache),
+                                      partial(classify.group_by_distance)])
+def test_unnamed_grouping_not_cached(words, grouping, tmp_path):
+    cache = ResultCache(tmp_path)
+    classify.run(words, grouping=grouping, result_cache=cache)
+    assert not cache.hits and not cache.misses
+
+
+def test_budgeted_run_not_cached(tmp_path):
+    words = synthetic.flatten(synthetic.root_and_pattern(300, seed=0), seed=0)
+    cache = ResultCache(tmp_path)
+    budget = classify.Budget(max_pairs=10)
+    assert not classify.run(words, budget=budget, result_cache=cache).completed
+
+    result = classify.run(words, result_cache=cache)
+    assert not cache.hits
+    assert result.completed and result == classify.run(words)
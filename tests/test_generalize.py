@@ -0,0 +1,43 @@
+"""
+Checks that the threaded and cached runs of generalize give the same results as the plain run
+"""
+
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from regexi import generalize
+from regexi.resultcache import ResultCache
+
+DATA = Path(__file__).parent.parent / 'data'
+
+
+@pytest.fixture(scope='module')
+def groups():
+    with open(str(DATA / 'english_signatures.json')) as groups_file:
+        return json.load(groups_file)
+
+
+def test_threads_same_as_serial(groups):
+    expected = generalize.run(groups, rng=random.Random(0))
+    assert generalize.run(groups, rng=random.Random(0), threads=4) == expected
+
+
+def test_same_seed_same_result(groups):
+    assert generalize.run(groups, rng=random.Random(1)) == generalize.run(groups, rng=random.Random(1))
+
+
+def test_cached_same_as_uncached(groups, tmp_path):
+    cache = ResultCache(tmp_path)
+    expected = generalize.run(groups, rng=random.Random(0))
+    assert generalize.run(groups, rng=random.Random(0), result_cache=cache) == expected
+    assert generalize.run(groups, rng=random.Random(0), result_cache=cache) == expected
+    assert cache.hits == 1
+
+
+def test_not_cached_without_rng(groups, tmp_path):
+    cache = ResultCache(tmp_path)
+    generalize.run(groups, result_cache=cache)
+    assert not cache.hits and not cache.misses
@@ -0,0 +1,90 @@
+"""
+Checks that the LCS engine of patternize agrees with the heuristic one and with a plain LCS on small inputs
+"""
+
+import itertools
+import re
+
+import pytest
+
+from regexi import patternize
+from regexi.patternize import AmbiguousElement
+from regexi.resultcache import ResultCache
+
+PAIRS = [('kataba', 'kutiba'), ('maktab', 'kitāb'), ('darasa', 'madrasa'), ('abc', 'xyz'), ('', 'abc')]
+
+
+def lcs_table_length(one, two):
+    lengths = [[0] * (len(two) + 1) for _ in range(len(one) + 1)]
+    for i, j in itertools.product(range(len(one)), range(len(two))):
+        if one[i] == two[j]:
+            lengths[i + 1][j + 1] = lengths[i][j] + 1
+        else:
+            lengths[i + 1][j + 1] = max(lengths[i][j + 1], lengths[i + 1][j])
+    return lengths
+
+
+@pytest.mark.parametrize('one, two', PAIRS)
+def test_lcs_rows_same_as_table(one, two):
+    rows = patternize.get_lcs_rows(list(one), list(two))
+    lengths = lcs_table_length(one, two)
+    for i, j in itertools.product(range(len(one) + 1), range(len(two) + 1)):
+        assert i - bin(rows[j] & ((1 << i) - 1)).count('1') == lengths[i][j]
+
+
+def test_lcs_rows_ambiguous_elements():
+    # an ambiguous element matches any of its characters
+    rows = patternize.get_lcs_rows([AmbiguousElement('a', 'u'), 't'], list('ut'))
+    # (no ones left in the last row means that the LCS is as long as the first sequence)
+    assert rows[-1] == 0
+
+
+def to_regex(pattern):
+    parts = []
+    for element in pattern:
+        if element is None:
+            parts.append('.*')
+        elif isinstance(element, AmbiguousElement):
+            parts.append('[{}]'.format(''.join(sorted(element))))
+        else:
+            parts.append(re.escape(element))
+    return ''.join(parts)
+
+
+@pytest.mark.parametrize('one, two', PAIRS[:3] + [('walad', 'awlād')])
+def test_lcs_pattern_matches_both(one, two):
+    pattern = patternize.find_lcs_pattern(one, two)
+    regex = to_regex(pattern)
+    assert re.fullmatch(regex, one) and re.fullmatch(regex, two)
+    assert sum(element is not None for element in pattern) == lcs_table_length(one, two)[-1][-1]
+
+
+@pytest.mark.parametrize('one, two', [('kataba', 'kutiba'), ('maktab', 'kitāb'), ('kitāb', 'kutub')])
+def test_lcs_same_as_heuristic(one, two):
+    # (where the common characters can only be aligned one way)
+    assert patternize.find_lcs_pattern(one, two) == patternize.get_common_pattern(one, two)
+
+
+def test_lcs_pattern_keeps_whole_lcs():
+    pattern = patternize.find_lcs_pattern('darasa', 'madrasa')
+    assert ''.join(element for element in pattern if element is not None) == 'drasa'
+
+
+def test_cached_same_as_uncached(tmp_path):
+    words = ['kataba', 'kutiba', 'kātib', 'kitāb']
+    cache = ResultCache(tmp_path)
+    expected = patternize.run_find_all(words, regexify=False)
+    assert patternize.run_find_all(words, regexify=False, result_cache=cache) == expected
+    assert patternize.run_find_all(words, regexify=False, result_cache=cache) == expected
+    assert cache.hits == 1
+
+
+def test_text_same_words_as_corpus(tmp_path):
+    text = "kataba kutiba\nKātib kitāb kutub\nka'aba kataba\n"
+    text_path = tmp_path / 'words.txt'
+    text_path.write_text(text, encoding='utf-8')
+    corpus_path = tmp_path / 'words.corpus'
+    patternize.corpus.compile_corpus(patternize.corpus.tokenize(text.splitlines()), str(corpus_path))
+
+    # (ka'aba is one word in both, rather than two in the plain text)
+    assert patternize.run(str(text_path), False) == patternize.run(str(corpus_path), False)
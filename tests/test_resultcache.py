@@ -0,0 +1,41 @@
+"""
+Checks that the result cache treats files it can't read as misses
+"""
+
+import gzip
+
+import pytest
+
+from regexi.resultcache import ResultCache
+
+
+def write_gzip(path, data):
+    with gzip.open(str(path), 'wb') as file:
+        file.write(data)
+
+
+@pytest.mark.parametrize('write', [
+    lambda path: path.write_bytes(b'not gzip at all'),
+    lambda path: path.write_bytes(gzip.compress(b'{"cut": "short"}')[:-12]),
+    lambda path: write_gzip(path, b'{"not": json'),
+    lambda path: write_gzip(path, b'\xff\xfe'),
+], ids=['not gzip', 'cut short', 'not json', 'not utf-8'])
+def test_unreadable_file_is_a_miss(tmp_path, write):
+    cache = ResultCache(tmp_path)
+    key = cache.key('test', ['a', 'b'], {})
+    write(cache._path(key))
+
+    assert cache.get(key) is None
+    assert cache.misses == 1
+    assert not cache._path(key).exists()
+
+    cache.put(key, [1, 2])
+    assert cache.get(key) == [1, 2]
+
+
+def test_eviction(tmp_path):
+    cache = ResultCache(tmp_path, max_size=0)
+    key = cache.key('test', ['a'], {})
+    cache.put(key, 'result')
+    assert cache.get(key) is None
+    assert cache.evictions == 1
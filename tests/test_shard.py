@@ -0,0 +1,56 @@
+"""
+Checks that the work queue of the sharded executor survives jobs being requeued and runs following each other
+"""
+
+import os
+from collections import Counter
+
+from regexi import classify, shard, synthetic
+
+
+def test_requeued_job_claimed_again(tmp_path):
+    queue = shard.WorkQueue(tmp_path)
+    queue.put('job.json.gz', {'n': 1})
+
+    first_claim, job = queue.claim()
+    assert job == {'n': 1}
+    # (as if the first worker had been stuck for longer than the stale time)
+    queue.requeue_stale(-1)
+    second_claim, _ = queue.claim()
+    assert second_claim != first_claim
+
+    # the first worker finishing late leaves the claim of the second one alone
+    queue.complete(first_claim, {'done': 1})
+    assert os.listdir(str(queue.claimed)) == [second_claim]
+    queue.complete(second_claim, {'done': 1})
+    assert not os.listdir(str(queue.claimed))
+    assert queue.pop_result('job.json.gz') == {'done': 1}
+
+
+def test_requeued_job_done_before_claimed_again(tmp_path):
+    queue = shard.WorkQueue(tmp_path)
+    queue.put('job.json.gz', {'n': 1})
+
+    claim, _ = queue.claim()
+    queue.requeue_stale(-1)
+    queue.complete(claim, {'done': 1})
+    assert not os.listdir(str(queue.pending)) and not os.listdir(str(queue.claimed))
+    assert queue.pop_result('job.json.gz') == {'done': 1}
+
+
+def test_executors_one_after_another(tmp_path):
+    # (the first round of both has the same number, so only the ids of the runs tell their word lists apart)
+    for groups in ([['kataba', 'kutiba', 'kātib'], ['darasa', 'dars', 'madrasa', 'mudarris']],
+                   [['qalam', 'aqlām'], ['nazala', 'nuzul', 'manzil']]):
+        with shard.ShardedExecutor(tmp_path / 'queue', workers=0) as executor:
+            expected = Counter()
+            for group in groups:
+                expected.update(classify.get_patterns(group))
+            assert executor.extract(groups) == expected
+
+
+def test_runs_one_after_another(tmp_path):
+    for size in (300, 100):
+        words = synthetic.flatten(synthetic.root_and_pattern(size, seed=0), seed=0)
+        with shard.ShardedExecutor(tmp_path / 'queue', workers=0) as executor:
+            assert classify.run(words, shards=executor) == classify.run(words)